@@ -0,0 +1,126 @@
+'''
+Offline rendering of camera fly-throughs.
+
+    python3 mosley.py --headless --camera-path fly.json --spp 64 --output frames/mosley%04d.png
+
+The camera path is a JSON list of keyframes, e.g.
+    [{"frame": 0, "position": [1.2, 1.5, 6], "look_at": [0, 0, 0], "fov": 0.23},
+     {"frame": 120, "position": [0, 0.5, 3], "look_at": [0, 0.2, 0]}]
+(fov is optional). Positions and look-at points are interpolated with
+Catmull-Rom splines. Frames are encoded and written by a thread pool while
+the next ones render.
+'''
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import taichi as ti
+
+
+class CameraPath:
+    def __init__(self, keyframes, default_fov=0.23):
+        if not keyframes:
+            raise ValueError("A camera path needs at least one keyframe")
+        keyframes = sorted(keyframes, key=lambda k: k['frame'])
+        self.frames = np.array([k['frame'] for k in keyframes], np.float64)
+        duplicates = np.unique(self.frames[1:][np.diff(self.frames) == 0])
+        if len(duplicates):
+            raise ValueError("Several keyframes at frames "
+                             f"{', '.join(f'{f:g}' for f in duplicates)}")
+        self.positions = np.array([k['position'] for k in keyframes],
+                                  np.float64)
+        self.look_ats = np.array([k['look_at'] for k in keyframes],
+                                 np.float64)
+        fovs = [k.get('fov') for k in keyframes]
+        for i, fov in enumerate(fovs):
+            if fov is None:
+                fovs[i] = fovs[i - 1] if i > 0 else default_fov
+        self.fovs = np.array(fovs, np.float64)
+
+    @staticmethod
+    def load(fname, default_fov=0.23):
+        with open(fname) as f:
+            return CameraPath(json.load(f), default_fov)
+
+    @property
+    def num_frames(self):
+        return int(self.frames[-1]) + 1
+
+    def __call__(self, frame):
+        '''
+        Camera position, look at and fov at frame
+        '''
+        i = np.searchsorted(self.frames, frame, side='right') - 1
+        i = min(max(i, 0), len(self.frames) - 2)
+        if i < 0:  # single keyframe
+            return self.positions[0], self.look_ats[0], self.fovs[0]
+        t = (frame - self.frames[i]) / (self.frames[i + 1] - self.frames[i])
+        t = min(max(t, 0.), 1.)
+        return (_catmull_rom(self.positions, i, t),
+                _catmull_rom(self.look_ats, i, t),
+                (1 - t) * self.fovs[i] + t * self.fovs[i + 1])
+
+
+def _catmull_rom(points, i, t):
+    '''
+    Point at t in [0, 1] of the spline segment between points i and i + 1
+    '''
+    p0 = points[max(i - 1, 0)]
+    p1 = points[i]
+    p2 = points[i + 1]
+    p3 = points[min(i + 2, len(points) - 1)]
+    return 0.5 * ((2 * p1) + (p2 - p0) * t +
+                  (2 * p0 - 5 * p1 + 4 * p2 - p3) * t**2 +
+                  (3 * p1 - p0 - 3 * p2 + p3) * t**3)
+
+
+def frame_file_name(output, frame):
+    '''
+    output is either a printf pattern (frame%04d.png) or a file name to
+    which the frame number is appended
+    '''
+    if '%' in output:
+        return output % frame
+    root, ext = os.path.splitext(output)
+    return f"{root}{frame:04d}{ext or '.png'}"
+
+
+def render_sequence(renderer, path, spp, output='frame.png', first=0,
+                    last=None, workers=2):
+    '''
+    Renders the frames first..last of the camera path with spp samples
+    each. Returns the file names.
+    '''
+    if last is None:
+        last = path.num_frames - 1
+    out_dir = os.path.dirname(frame_file_name(output, first))
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    fnames = []
+    pending = []
+    t = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for frame in range(first, last + 1):
+            position, look_at, fov = path(frame)
+            renderer.set_camera_pos(*position)
+            renderer.set_look_at(*look_at)
+            renderer.set_fov(fov)
+            renderer.reset_framebuffer()
+            for _ in range(spp):
+                renderer.accumulate()
+            #to_numpy() waits for the kernels, a copy is kept for the writer
+            img = renderer.fetch_image().to_numpy()
+            fname = frame_file_name(output, frame)
+            pending.append(pool.submit(ti.tools.imwrite, img, fname))
+            fnames.append(fname)
+            #don't let the encoding queue grow without bound
+            while len(pending) > 2 * workers:
+                pending.pop(0).result()
+        for future in pending:
+            future.result()
+    elapsed_time = time.time() - t
+    n = last - first + 1
+    print(f"Rendered {n} frames at {spp} spp in {elapsed_time:.2f}s "
+          f"({3600 * n / elapsed_time:.0f} frames/hour)")
+    return fnames
@@ -0,0 +1,185 @@
+'''
+Performance baseline of the bundled scenes, rendered headless.
+
+    python3 benchmark.py --arch cpu --res 160x90 320x180 --spp 4 16 --output bench.json
+
+For each scene, resolution and spp count it reports as JSON:
+the JIT compile time, ms per Renderer.render() launch, primary rays/sec
+and SDF evaluations/sec (counted in a separate, untimed pass). For scenes
+with parameters (Scene.add_parameter()) it also reports the cost of a
+parameter change, to compare with the compile time it avoids.
+--pipeline megakernel wavefront compares the two rendering pipelines.
+'''
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+import taichi as ti
+import scene as scene_module
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCENES = {
+    'default': None,  # renderer.default_SDF
+    'example': os.path.join(HERE, 'example.py'),
+    'mosley': os.path.join(HERE, 'mosley.py'),
+    'pklein': os.path.join(HERE, 'pklein.py'),
+}
+
+
+def load_benchmark_scene(name, arch='cpu', threads=None):
+    '''
+    Returns the Scene of one of the bundled SDFs, without window.
+    '''
+    options = dict(arch=arch, threads=threads, offline_cache=False)
+    path = SCENES[name]
+    if path is not None:
+        return scene_module.load_scene(path, **options)
+    # The default SDF has no script, light it like example.py
+    sc = scene_module.Scene(exposure=1., headless=True, finish=False,
+                            **options)
+    sc.set_floor(-1., (0.9, 0.9, 0.9))
+    sc.set_directional_light((1, 1, 2), 0.02, (2., 2., 1.5))
+    sc.set_background_color((0.2, 0.25, 0.3))
+    return sc
+
+
+def counting_sdf(sdf, counter):
+    '''
+    Wraps sdf so that each evaluation increments counter[None]
+    '''
+    @ti.func
+    def counted(p):
+        counter[None] += 1
+        return sdf(p)
+
+    return counted
+
+
+def prepare(sc, res, pipeline=None):
+    renderer = sc.renderer.clone(res)
+    if pipeline is not None:
+        renderer.pipeline = pipeline
+    renderer.set_camera_pos(*sc.camera.position)
+    renderer.set_look_at(*sc.camera.look_at)
+    return renderer
+
+
+def benchmark_renderer(renderer, spp):
+    '''
+    Times the first launch (compile + render) and spp more launches
+    Returns the compile time and the seconds per launch.
+    '''
+    t = time.perf_counter()
+    renderer.accumulate()
+    ti.sync()
+    first_launch = time.perf_counter() - t
+
+    renderer.reset_framebuffer()
+    t = time.perf_counter()
+    for _ in range(spp):
+        renderer.accumulate()
+    ti.sync()
+    per_launch = (time.perf_counter() - t) / spp
+    return max(first_launch - per_launch, 0.), per_launch
+
+
+def parameter_update_time(renderer):
+    '''
+    Average time of a parameter change (upload to its field, no
+    recompilation of the next launch), None without parameters
+    '''
+    times = []
+    for name in renderer.sdf_parameters:
+        value = renderer.get_parameter(name)
+        for new_value in (value + 1, value):
+            t = time.perf_counter()
+            renderer.set_parameter(name, new_value)
+            ti.sync()
+            times.append(time.perf_counter() - t)
+            renderer.accumulate()
+    if not times:
+        return None
+    return sum(times) / len(times)
+
+
+def count_sdf_evals(sc, res, spp, pipeline=None):
+    '''
+    Average number of SDF evaluations per render() launch
+    '''
+    counter = ti.field(dtype=ti.i64, shape=())
+    renderer = prepare(sc, res, pipeline)
+    renderer.sdf = counting_sdf(renderer.sdf, counter)
+    renderer.accumulate()
+    counter[None] = 0
+    for _ in range(spp):
+        renderer.accumulate()
+    return counter[None] / spp
+
+
+def run(scenes, resolutions, spps, arch='cpu', threads=None,
+        pipelines=('megakernel',)):
+    results = []
+    for name in scenes:
+        sc = load_benchmark_scene(name, arch, threads)
+        for res, spp, pipeline in itertools.product(resolutions, spps,
+                                                    pipelines):
+            renderer = prepare(sc, res, pipeline)
+            compile_time, per_launch = benchmark_renderer(renderer, spp)
+            update_time = parameter_update_time(renderer)
+            sdf_evals = count_sdf_evals(sc, res, spp, pipeline)
+            rays = res[0] * res[1]
+            results.append({
+                'scene': name,
+                'arch': arch,
+                'pipeline': pipeline,
+                'res': list(res),
+                'spp': spp,
+                'compile_s': compile_time,
+                'param_update_s': update_time,
+                'ms_per_launch': per_launch * 1e3,
+                'primary_rays_per_s': rays / per_launch,
+                'sdf_evals_per_launch': sdf_evals,
+                'sdf_evals_per_s': sdf_evals / per_launch,
+            })
+            print(f"{name} {pipeline} {res[0]}x{res[1]} spp={spp}: "
+                  f"{per_launch * 1e3:.2f} ms/launch, "
+                  f"{rays / per_launch / 1e6:.2f} Mrays/s, "
+                  f"{sdf_evals / per_launch / 1e6:.2f} M SDF evals/s, "
+                  f"compile {compile_time:.2f}s" +
+                  ("" if update_time is None else
+                   f", parameter update {update_time * 1e3:.2f} ms"),
+                  file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scenes', nargs='+', choices=list(SCENES),
+                        default=list(SCENES))
+    parser.add_argument('--res', nargs='+', type=scene_module._parse_res,
+                        default=[(160, 90), (320, 180)])
+    parser.add_argument('--spp', nargs='+', type=int, default=[4, 16])
+    parser.add_argument('--arch', choices=scene_module.ARCHS, default='cpu')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--pipeline', nargs='+',
+                        choices=scene_module.PIPELINES,
+                        default=['megakernel'])
+    parser.add_argument('--output', default=None,
+                        help='JSON file (default: stdout)')
+    args = parser.parse_args()
+
+    results = run(args.scenes, args.res, args.spp, args.arch, args.threads,
+                  args.pipeline)
+    report = json.dumps({'results': results}, indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+'''
+Checkpoints of the raw accumulation buffer, to resume long renders and to
+merge renders of the same view made on several machines.
+
+A checkpoint is a memory-mapped float32 .npy file of shape (w, h, 5): the
+summed colors, the number of samples and the summed squared luminances (the
+variance estimate of adaptive sampling, zero without it) of each pixel, so
+that it stays consistent pixel by pixel even if a write is interrupted. A .json file
+next to it holds the spp, the sampler, the (seed, first, end) sample
+index ranges of the samples and a hash of the scene and camera.
+
+    python3 mosley.py --headless --spp 4096 --checkpoint mosley.npy --checkpoint-interval 600
+    python3 checkpoint.py merge merged.npy node1.npy node2.npy
+    python3 mosley.py --headless --spp 0 --checkpoint merged.npy --output mosley.png
+'''
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import numpy as np
+
+import renderer as renderer_module
+
+#Renderer settings that don't change the converged image
+_sampling_attrs = ('sampler', 'seed', 'adaptive_threshold', 'adaptive_tile',
+                   'adaptive_min_spp', 'temporal_max_history',
+                   'temporal_tolerance', 'denoiser_settings',
+                   'prepass_tile', 'vignette_strength', 'vignette_radius',
+                   'vignette_center', 'pipeline', 'collect_stats')
+
+
+def _describe(value):
+    if hasattr(value, 'sdf_graph'):
+        return repr(value.sdf_graph)
+    if callable(value):
+        func = getattr(value, '__wrapped__', value)
+        try:
+            return inspect.getsource(func)
+        except (OSError, TypeError):
+            return getattr(func, '__qualname__', repr(func))
+    if isinstance(value, dict):
+        return repr({k: _describe(v) for k, v in sorted(value.items())})
+    if hasattr(value, 'to_numpy'):
+        return repr(value.to_numpy().tolist())
+    if type(value).__repr__ is object.__repr__:
+        #objects like the sdf cache: only their type matters
+        return type(value).__name__
+    return repr(value)
+
+
+def view_hash(renderer):
+    '''
+    Hash of what the accumulated samples depend on: scene, camera,
+    resolution and rendering settings
+    '''
+    h = hashlib.sha1()
+    for name in renderer._setting_fields:
+        h.update(f"{name}={_describe(getattr(renderer, name)[None])}".encode())
+    for name in renderer._setting_attrs:
+        if name not in _sampling_attrs:
+            h.update(f"{name}={_describe(getattr(renderer, name))}".encode())
+    h.update(repr((renderer.image_res, renderer.resolution_scale,
+                   renderer_module.MAX_RAY_DEPTH,
+                   renderer_module.DIS_LIMIT)).encode())
+    return h.hexdigest()
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.meta_path = path + '.json'
+        self._buffer = None
+        #sample ranges of the loaded checkpoint, and the first index of the
+        #samples added to it
+        self._ranges = []
+        self._first = None
+
+    def exists(self):
+        return os.path.exists(self.path) and os.path.exists(self.meta_path)
+
+    def read_meta(self):
+        with open(self.meta_path) as f:
+            return json.load(f)
+
+    def _write_meta(self, meta):
+        tmp = self.meta_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, self.meta_path)
+
+    def _open(self, shape):
+        if self._buffer is None or self._buffer.shape != shape:
+            mode = 'r+' if os.path.exists(self.path) else 'w+'
+            if mode == 'r+' and np.load(self.path, mmap_mode='r').shape != shape:
+                mode = 'w+'
+            self._buffer = np.lib.format.open_memmap(
+                self.path, mode=mode, dtype=np.float32, shape=shape)
+        return self._buffer
+
+    def save(self, renderer):
+        '''
+        Writes the accumulation buffer of renderer
+        '''
+        color = renderer.color_buffer.to_numpy()
+        if renderer._sample_count is not None:
+            count = renderer._sample_count.to_numpy()
+        else:
+            count = np.full(color.shape[:2], renderer.current_spp)
+        buffer = self._open(color.shape[:2] + (5,))
+        buffer[..., :3] = color
+        buffer[..., 3] = count
+        buffer[..., 4] = 0 if renderer._lum_sq_buffer is None else \
+            renderer._lum_sq_buffer.to_numpy()
+        buffer.flush()
+        first = renderer.sample_offset if self._first is None else \
+            self._first
+        end = renderer.sample_offset + renderer.current_spp
+        ranges = [list(r) for r in self._ranges]
+        if ranges and ranges[-1][0] == renderer.seed and \
+                ranges[-1][2] == first:
+            #resumed render: the samples follow the loaded ones
+            ranges[-1][2] = max(end, first)
+        elif end > first:
+            ranges.append([renderer.seed, first, end])
+        self._write_meta({
+            'hash': view_hash(renderer),
+            'spp': renderer.current_spp,
+            'sampler': renderer.sampler,
+            'moments': renderer._lum_sq_buffer is not None,
+            'sample_ranges': ranges,
+        })
+
+    def load(self, renderer):
+        '''
+        Puts the checkpoint back in renderer (whose settings must match the
+        ones it was made with). Returns False when there is no checkpoint.
+        '''
+        if not self.exists():
+            return False
+        meta = self.read_meta()
+        renderer._prepare()
+        if meta['hash'] != view_hash(renderer):
+            raise ValueError(f"{self.path} was rendered with another scene, "
+                             "camera or resolution")
+        buffer = np.load(self.path, mmap_mode='r')
+        count = buffer[..., 3]
+        if renderer._lum_sq_buffer is not None and not meta['moments']:
+            #zero second moments would be taken for converged pixels
+            raise ValueError(f"{self.path} was rendered without adaptive "
+                             "sampling, disable it to resume it")
+        renderer.reset_framebuffer()
+        if count.min() != count.max():
+            if renderer._sample_count is None:
+                raise ValueError(f"{self.path} has per-pixel sample counts, "
+                                 "enable adaptive sampling to resume it")
+            renderer._sample_count.from_numpy(count.astype(np.int32))
+        elif renderer._sample_count is not None:
+            renderer._sample_count.from_numpy(count.astype(np.int32))
+        renderer.color_buffer.from_numpy(np.ascontiguousarray(buffer[..., :3]))
+        if renderer._lum_sq_buffer is not None:
+            renderer._lum_sq_buffer.from_numpy(
+                np.ascontiguousarray(buffer[..., 4]))
+        renderer.current_spp = meta['spp']
+        #new samples must not repeat the ones of the checkpoint made with the
+        #same seed. The checkpoint may hold samples of other seeds (merged),
+        #so the offset can be negative: only the next index matters.
+        self._ranges = meta['sample_ranges']
+        self._first = max((end for seed, _, end in self._ranges
+                           if seed == renderer.seed), default=0)
+        renderer.sample_offset = self._first - renderer.current_spp
+        return True
+
+
+def merge(paths, output):
+    '''
+    Sums checkpoints of the same view into output
+    '''
+    metas = [Checkpoint(p).read_meta() for p in paths]
+    if len(set(m['hash'] for m in metas)) > 1:
+        raise ValueError("Checkpoints of different views can't be merged")
+    if len(set(m['sampler'] for m in metas)) > 1:
+        raise ValueError("Checkpoints of different samplers can't be merged")
+    #the random sampler doesn't repeat samples
+    ranges = [r for m in metas for r in m['sample_ranges']] \
+        if metas[0]['sampler'] in ('hash', 'sobol') else []
+    for i, (seed, first, end) in enumerate(ranges):
+        for seed2, first2, end2 in ranges[i + 1:]:
+            if seed == seed2 and first < end2 and first2 < end:
+                raise ValueError("Checkpoints share samples (same seed and "
+                                 "sample range), use other seeds or offsets")
+    total = None
+    for p in paths:
+        buffer = np.load(p, mmap_mode='r')
+        total = np.array(buffer) if total is None else total + buffer
+    out = Checkpoint(output)
+    buffer = out._open(total.shape)
+    buffer[...] = total
+    buffer.flush()
+    out._write_meta({
+        'hash': metas[0]['hash'],
+        'spp': sum(m['spp'] for m in metas),
+        'sampler': metas[0]['sampler'],
+        'moments': all(m['moments'] for m in metas),
+        'sample_ranges': [r for m in metas for r in m['sample_ranges']],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest='command', required=True)
+    merge_parser = sub.add_parser('merge', help='sum checkpoints of a view')
+    merge_parser.add_argument('output')
+    merge_parser.add_argument('inputs', nargs='+')
+    args = parser.parse_args()
+    merge(args.inputs, args.output)
+    print(f"Merged {len(args.inputs)} checkpoints into {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+'''
+Equal-time convergence of renderer configurations against cached reference
+renders of the bundled scenes.
+
+    python3 convergence.py run --scenes example --res 160x90 --time 20 --config sampler=hash --config sampler=sobol --output curves.json
+    python3 convergence.py compare old.json new.json
+
+The reference of each scene, resolution and view is rendered once
+(--reference-spp samples of an unbiased setup) and cached in --cache, keyed
+by the view hash of checkpoint.py so that changing the scene renders it
+again. Each configuration (Renderer attributes and MAX_RAY_DEPTH, as
+key=value) then renders for --time seconds; its RMSE and relative MSE
+against the reference are measured (untimed) at growing spp counts and
+written as curves of error vs seconds and spp, up to --max-spp (a quarter
+of the reference's by default: closer to it, the error measured is the
+reference's own noise). The first configuration is
+the baseline of the time-to-quality summary; compare does the same between
+the curves of two runs, e.g. of two versions.
+'''
+import argparse
+import ast
+import contextlib
+import json
+import os
+import sys
+import time
+import numpy as np
+import taichi as ti
+
+import benchmark
+import renderer as renderer_module
+import scene as scene_module
+from checkpoint import view_hash
+
+REFERENCE_SAMPLER = 'sobol'
+#different from the seeds of the configurations so that their noise is
+#independent of the reference's
+REFERENCE_SEED = 7919
+#relative MSE: squared error / (reference^2 + RELMSE_EPS)
+RELMSE_EPS = 1e-2
+#largest spp of the curves, as a fraction of the reference spp
+MAX_SPP_FRACTION = 0.25
+#module settings a configuration can change besides the Renderer attributes
+MODULE_SETTINGS = ('MAX_RAY_DEPTH',)
+_CHOICES = {'sampler': renderer_module.SAMPLERS,
+            'pipeline': renderer_module.PIPELINES,
+            'normal_strategy': renderer_module.NORMAL_STRATEGIES}
+
+
+def parse_config(items):
+    '''
+    ['sampler=sobol', 'ray_march_relaxation=1.5'] -> dict, the values are
+    Python literals or strings
+    '''
+    config = {}
+    for item in items:
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f"Expected key=value, got {item!r}")
+        if key not in renderer_module.Renderer._setting_attrs and \
+                key not in MODULE_SETTINGS:
+            raise ValueError(f"Unknown setting {key!r}")
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+        if key in _CHOICES and value not in _CHOICES[key]:
+            raise ValueError(f"Unknown {key} {value!r}, expected one of "
+                             f"{_CHOICES[key]}")
+        config[key] = value
+    return config
+
+
+def config_name(config):
+    return ' '.join(f"{k}={v}" for k, v in config.items()) or 'default'
+
+
+@contextlib.contextmanager
+def module_settings(config):
+    '''
+    Sets the module settings of config while the renderers are compiled
+    '''
+    saved = {k: getattr(renderer_module, k) for k in MODULE_SETTINGS}
+    try:
+        for k in MODULE_SETTINGS:
+            if k in config:
+                setattr(renderer_module, k, config[k])
+        yield
+    finally:
+        for k, v in saved.items():
+            setattr(renderer_module, k, v)
+
+
+def errors(image, reference):
+    '''
+    RMSE and relative MSE of image
+    '''
+    se = (image - reference)**2
+    return (float(np.sqrt(se.mean())),
+            float((se / (reference**2 + RELMSE_EPS)).mean()))
+
+
+def reference_image(sc, name, res, spp, cache):
+    '''
+    Average color of the reference render of the scene, from the cache when
+    it was rendered before. Returns it and its file name.
+    '''
+    renderer = benchmark.prepare(sc, res)
+    #unbiased: no denoiser, every pixel gets all the samples
+    renderer.sampler = REFERENCE_SAMPLER
+    renderer.seed = REFERENCE_SEED
+    renderer.denoiser_settings = None
+    renderer.adaptive_threshold = 0
+    renderer.temporal_max_history = 0
+    path = os.path.join(cache, f"{name}_{res[0]}x{res[1]}_{spp}spp_"
+                        f"{view_hash(renderer)[:16]}.npy")
+    if os.path.exists(path):
+        return np.load(path), path
+    os.makedirs(cache, exist_ok=True)
+    t = time.time()
+    for _ in range(spp):
+        renderer.accumulate()
+    image = renderer.fetch_average().to_numpy()
+    np.save(path, image)
+    print(f"Rendered the reference of {name} ({spp} spp) in "
+          f"{time.time() - t:.1f}s, saved to {path}", file=sys.stderr)
+    return image, path
+
+
+def convergence_curve(renderer, reference, time_budget, max_spp=None):
+    '''
+    Errors of the renderer after 1, 2, 3, 4, 5, 7, 9, 12... samples until
+    time_budget seconds of rendering (without the compilation nor the
+    measurements) or max_spp samples
+    '''
+    renderer.accumulate()
+    ti.sync()
+    renderer.reset_framebuffer()
+    curve = []
+    seconds = 0.
+    next_point = 1
+    while seconds < time_budget and (max_spp is None or
+                                     renderer.current_spp < max_spp):
+        t = time.perf_counter()
+        renderer.accumulate()
+        ti.sync()
+        seconds += time.perf_counter() - t
+        spp = renderer.current_spp
+        done = seconds >= time_budget or spp == max_spp or \
+            renderer.converged
+        if spp >= next_point or done:
+            rmse, relmse = errors(renderer.fetch_average().to_numpy(),
+                                  reference)
+            curve.append({'spp': spp, 'seconds': seconds, 'rmse': rmse,
+                          'relmse': relmse})
+            next_point = max(next_point + 1, int(next_point * 2**0.5))
+        if renderer.converged:
+            break
+    return curve
+
+
+def _log_curve(curve, key):
+    seconds = np.log([p['seconds'] for p in curve])
+    #the best error reached so far, so that the curve is monotonic
+    error = np.log(np.maximum(np.minimum.accumulate(
+        [p[key] for p in curve]), 1e-30))
+    return seconds, error
+
+
+def time_to_error(curve, target, key='relmse'):
+    '''
+    Seconds to reach an error target (log-log interpolation), None if the
+    curve doesn't reach it
+    '''
+    seconds, error = _log_curve(curve, key)
+    target = np.log(target)
+    if error[-1] > target:
+        return None
+    i = int(np.argmax(error <= target))
+    if i == 0:
+        return float(np.exp(seconds[0]))
+    a = (target - error[i - 1]) / (error[i] - error[i - 1])
+    return float(np.exp(seconds[i - 1] + a * (seconds[i] - seconds[i - 1])))
+
+
+def error_at_time(curve, t, key='relmse'):
+    '''
+    Error after t seconds (log-log interpolation), None outside of the curve
+    '''
+    seconds, error = _log_curve(curve, key)
+    if not seconds[0] <= np.log(t) <= seconds[-1]:
+        return None
+    return float(np.exp(np.interp(np.log(t), seconds, error)))
+
+
+def compare_curves(base, other, key='relmse'):
+    '''
+    Time-to-quality of other relative to base: speedup to reach the error
+    both curves reach, and error ratio at the time both curves last
+    '''
+    target = max(base[-1][key], other[-1][key])
+    t_base = time_to_error(base, target, key)
+    t_other = time_to_error(other, target, key)
+    t = min(base[-1]['seconds'], other[-1]['seconds'])
+    e_base = error_at_time(base, t, key)
+    e_other = error_at_time(other, t, key)
+    return {
+        'target_' + key: target,
+        'speedup': t_base / t_other if t_base and t_other else None,
+        'seconds': t,
+        'error_ratio': e_other / e_base if e_base and e_other else None,
+    }
+
+
+def _format_comparison(label, c, key='relmse'):
+    speedup = '-' if c['speedup'] is None else f"{c['speedup']:.2f}x"
+    ratio = '-' if c['error_ratio'] is None else f"{c['error_ratio']:.2f}x"
+    return (f"{label}: {speedup} faster to {key} {c['target_' + key]:.3g}, "
+            f"{ratio} the {key} at {c['seconds']:.1f}s")
+
+
+def run(scenes, res, configs, time_budget, reference_spp, cache,
+        arch='cpu', threads=None, max_spp=None):
+    limit = max(int(reference_spp * MAX_SPP_FRACTION), 1)
+    if max_spp is None:
+        max_spp = limit
+    elif max_spp > limit:
+        print(f"Warning: beyond {limit} spp the errors mostly measure the "
+              f"noise of the {reference_spp} spp reference", file=sys.stderr)
+    results = []
+    for name in scenes:
+        sc = benchmark.load_benchmark_scene(name, arch, threads)
+        reference, reference_path = reference_image(sc, name, res,
+                                                    reference_spp, cache)
+        for config in configs:
+            with module_settings(config):
+                renderer = benchmark.prepare(sc, res)
+                for k, v in config.items():
+                    if k not in MODULE_SETTINGS:
+                        setattr(renderer, k, v)
+                curve = convergence_curve(renderer, reference, time_budget,
+                                          max_spp)
+            results.append({
+                'scene': name,
+                'res': list(res),
+                'config': config,
+                'name': config_name(config),
+                'reference': reference_path,
+                'reference_spp': reference_spp,
+                'curve': curve,
+            })
+            last = curve[-1]
+            capped = last['spp'] == max_spp and last['seconds'] < time_budget
+            print(f"{name} {config_name(config)}: {last['spp']} spp in "
+                  f"{last['seconds']:.2f}s, RMSE {last['rmse']:.4g}, "
+                  f"relMSE {last['relmse']:.4g}"
+                  f"{' (stopped at --max-spp)' if capped else ''}",
+                  file=sys.stderr)
+    return results
+
+
+def summary(base_results, results, same_config=True):
+    '''
+    Comparisons of results with the baseline of the same scene and
+    resolution in base_results: the same configuration when same_config
+    and there is one, else the first one
+    '''
+    lines = []
+    for r in results:
+        bases = [b for b in base_results
+                 if (b['scene'], b['res']) == (r['scene'], r['res'])]
+        if same_config:
+            bases = [b for b in bases if b['name'] == r['name']] or bases
+        base = bases[0] if bases else None
+        if base is None or base is r:
+            continue
+        lines.append(_format_comparison(
+            f"{r['scene']} {r['name']} vs {base['name']}",
+            compare_curves(base['curve'], r['curve'])))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help='convergence curves of '
+                                'configurations')
+    run_parser.add_argument('--scenes', nargs='+',
+                            choices=list(benchmark.SCENES),
+                            default=list(benchmark.SCENES))
+    run_parser.add_argument('--res', type=scene_module._parse_res,
+                            default=(160, 90))
+    run_parser.add_argument('--config', nargs='*', action='append',
+                            metavar='KEY=VALUE',
+                            help='Renderer attributes or MAX_RAY_DEPTH, '
+                            'repeat --config for each configuration '
+                            '(default: the scene settings)')
+    run_parser.add_argument('--time', type=float, default=10.,
+                            help='seconds of rendering per configuration')
+    run_parser.add_argument('--max-spp', dest='max_spp', type=int,
+                            default=None, help='default: a quarter of '
+                            '--reference-spp')
+    run_parser.add_argument('--reference-spp', dest='reference_spp',
+                            type=int, default=1024)
+    run_parser.add_argument('--cache', default='references',
+                            help='directory of the reference renders')
+    run_parser.add_argument('--arch', choices=scene_module.ARCHS,
+                            default='cpu')
+    run_parser.add_argument('--threads', type=int, default=None)
+    run_parser.add_argument('--output', default=None,
+                            help='JSON file (default: stdout)')
+    compare_parser = sub.add_parser('compare', help='time-to-quality of the '
+                                    'curves of a run relative to another')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('other')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.base) as f:
+            base_results = json.load(f)['results']
+        with open(args.other) as f:
+            results = json.load(f)['results']
+        print('\n'.join(summary(base_results, results)))
+        return
+
+    try:
+        configs = [parse_config(items) for items in args.config or [[]]]
+    except ValueError as e:
+        parser.error(str(e))
+    results = run(args.scenes, args.res, configs, args.time,
+                  args.reference_spp, args.cache, args.arch, args.threads,
+                  args.max_spp)
+    for line in summary(results, results, same_config=False):
+        print(line, file=sys.stderr)
+    report = json.dumps({'time_budget': args.time, 'results': results},
+                        indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
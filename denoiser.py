@@ -0,0 +1,128 @@
+import time
+import taichi as ti
+
+B3_SPLINE = (1 / 16, 1 / 4, 3 / 8, 1 / 4, 1 / 16)
+
+
+@ti.data_oriented
+class Denoiser:
+    '''
+    Edge-avoiding a-trous wavelet filter (Dammertz et al. 2010) of the noisy
+    accumulated image, guided by the first hit normal, depth and albedo
+    the renderer records in the G-buffer.
+    Set enabled to False to display the noisy image (no recompilation).
+    '''
+    def __init__(self, image_res, iterations=5, sigma_color=0.5,
+                 sigma_normal=64., sigma_depth=0.05, sigma_albedo=0.1):
+        self.image_res = image_res
+        self.iterations = iterations
+        self.sigma_color = sigma_color
+        self.sigma_normal = sigma_normal
+        self.sigma_depth = sigma_depth
+        self.sigma_albedo = sigma_albedo
+        self.enabled = True
+        self.last_time = 0.  # seconds taken by the last filter()
+
+        #G-buffer, summed over the samples like the color
+        self.normal = ti.Vector.field(3, dtype=ti.f32, shape=image_res)
+        self.albedo = ti.Vector.field(3, dtype=ti.f32, shape=image_res)
+        self.depth = ti.field(dtype=ti.f32, shape=image_res)
+        #averages of the G-buffer
+        self._normal = ti.Vector.field(3, dtype=ti.f32, shape=image_res)
+        self._albedo = ti.Vector.field(3, dtype=ti.f32, shape=image_res)
+        self._depth = ti.field(dtype=ti.f32, shape=image_res)
+        #ping-pong buffers, output holds the filtered average color
+        self.output = ti.Vector.field(3, dtype=ti.f32, shape=image_res)
+        self._tmp = ti.Vector.field(3, dtype=ti.f32, shape=image_res)
+        self.active = ti.field(dtype=ti.i32, shape=())
+
+    def reset(self):
+        self.normal.fill(0)
+        self.albedo.fill(0)
+        self.depth.fill(0)
+
+    @ti.func
+    def record(self, u, v, normal, albedo, depth):
+        '''
+        Adds a sample of the G-buffer of the pixel u, v.
+        For misses, normal should be the opposite of the ray direction.
+        '''
+        self.normal[u, v] += normal
+        self.albedo[u, v] += albedo
+        self.depth[u, v] += depth
+
+    @ti.func
+    def store(self, u, v, normal, albedo, depth, n):
+        '''
+        Sets the G-buffer of the pixel u, v as n samples of these values
+        '''
+        self.normal[u, v] = normal * n
+        self.albedo[u, v] = albedo * n
+        self.depth[u, v] = depth * n
+
+    @ti.kernel
+    def _load(self, r: ti.template(), samples: ti.i32):
+        '''
+        Averages the color and the G-buffer of the (scaled) color_buffer
+        '''
+        k = r._scale[None]
+        for i, j in ti.ndrange(-(-self.image_res[0] // k),
+                               -(-self.image_res[1] // k)):
+            n = r.get_pixel_samples(i, j, samples)
+            self.output[i, j] = r.color_buffer[i, j] / n
+            self._normal[i, j] = self.normal[i, j].normalized(1e-8)
+            self._albedo[i, j] = self.albedo[i, j] / n
+            self._depth[i, j] = self.depth[i, j] / n
+
+    @ti.kernel
+    def _atrous(self, src: ti.template(), dst: ti.template(), step: ti.i32,
+                sigma_color: ti.f32, k: ti.i32):
+        w = -(-self.image_res[0] // k)
+        h = -(-self.image_res[1] // k)
+        for i, j in ti.ndrange(w, h):
+            cp = src[i, j]
+            np_ = self._normal[i, j]
+            dp = self._depth[i, j]
+            ap = self._albedo[i, j]
+            c = ti.Vector([0.0, 0.0, 0.0])
+            weights = 0.0
+            for dx, dy in ti.static(ti.ndrange((-2, 3), (-2, 3))):
+                x = ti.math.clamp(i + dx * step, 0, w - 1)
+                y = ti.math.clamp(j + dy * step, 0, h - 1)
+                cq = src[x, y]
+                weight = B3_SPLINE[dx + 2] * B3_SPLINE[dy + 2] * \
+                    ti.exp(-(cq - cp).norm_sqr() / sigma_color)
+                weight *= ti.max(self._normal[x, y].dot(np_),
+                                 0.)**self.sigma_normal
+                weight *= ti.exp(-ti.abs(self._depth[x, y] - dp) /
+                                 (self.sigma_depth * step * ti.max(dp, 1e-3)))
+                weight *= ti.exp(-(self._albedo[x, y] - ap).norm_sqr() /
+                                 self.sigma_albedo)
+                c += weight * cq
+                weights += weight
+            #a pixel without normal (no sample yet) weighs nothing, even
+            #itself: it keeps its color
+            if weights > 0:
+                dst[i, j] = c / weights
+            else:
+                dst[i, j] = cp
+
+    def filter(self, renderer, samples):
+        '''
+        Fills output with the denoised average color of renderer
+        '''
+        self.active[None] = self.enabled and samples > 0
+        if not self.active[None]:
+            return
+        ti.sync()
+        t = time.perf_counter()
+        k = renderer.resolution_scale
+        self._load(renderer, samples)
+        src, dst = self.output, self._tmp
+        for i in range(self.iterations):
+            self._atrous(src, dst, 2**i, self.sigma_color * 2**-i, k)
+            src, dst = dst, src
+        if src is not self.output:
+            self.output.copy_from(src)
+        ti.sync()
+        self.last_time = time.perf_counter() - t
@@ -1,5 +1,6 @@
 from tkinter import N
 from scene import Scene
+from sdf_graph import Box, Cylinder, Plane, Sphere
 import taichi as ti
 from taichi.math import *
 import math
@@ -24,31 +25,23 @@ def make_nested(f):
     f = (f - 0.2) / 40
     return f
 
-@ti.func
-def My_SDF_func(o):
-    wall = min(o[1] + 0.1, o[2] + 0.4)
-    sphere = (o - ti.Vector([0.0, 0.35, 0.0])).norm() - 0.36
-
-    q = ti.abs(o - ti.Vector([0.8, 0.3, 0])) - ti.Vector([0.3, 0.3, 0.3])
-    box = ti.Vector([max(0, q[0]), max(0, q[1]),
-                     max(0, q[2])]).norm() + min(q.max(), 0)
-
-    O = o - ti.Vector([-0.8, 0.3, 0])
-    d = ti.Vector([ti.Vector([O[0], O[2]]).norm() - 0.3, abs(O[1]) - 0.3])
-    cylinder = min(d.max(), 0.0) + ti.Vector([max(0, d[0]),
-                                              max(0, d[1])]).norm()
-
-    geometry = make_nested(min(sphere, box, cylinder))
-    geometry = max(geometry, -(0.32 - (o[1] * 0.6 + o[2] * 0.8)))
-    return min(wall, geometry)
+#The geometry as a scene graph (see sdf_graph.py): the shapes far from a
+#ray are skipped
+shapes = (Sphere(0.36).translate((0.0, 0.35, 0.0)) |
+          Box((0.3, 0.3, 0.3)).translate((0.8, 0.3, 0)) |
+          Cylinder(0.3, 0.3).translate((-0.8, 0.3, 0)))
+My_SDF = shapes.apply(make_nested, padding=0.005) & Plane((0, 0.6, 0.8), 0.32)
 
 @ti.func
 def My_SDF_col(o, n):
     return ti.Vector([0.75, 0.4, 0.5]) + 0.3 * n
 
 #the SDF and color functions are called from the renderer so let's tell it which functions to use.
-scene.set_sdf_func(My_SDF_func)
+scene.set_sdf_graph(My_SDF)
 scene.set_sdf_col(My_SDF_col)
+#the walls are analytic planes y = -0.1 and z = -0.4 (colored like My_SDF_col)
+scene.add_plane((0, 1, 0), -0.1, (0.75, 0.7, 0.5))
+scene.add_plane((0, 0, 1), -0.4, (0.75, 0.4, 0.8))
 
 #help preserving your GC: set it to something like 1000 if you want a high quality / lower noise results
 scene.maxSamples = 100
@@ -8,12 +8,20 @@ inf = 1e10
 
 @ti.func
 def out_dir(n):
+    return cosine_dir(n, ti.random(ti.f32), ti.random(ti.f32))
+
+
+@ti.func
+def cosine_dir(n, r1, r2):
+    '''
+    Cosine weighted direction around n from two uniform numbers in [0, 1)
+    '''
     u = ti.Vector([1.0, 0.0, 0.0])
     if ti.abs(n[1]) < 1 - 1e-3:
         u = n.cross(ti.Vector([0.0, 1.0, 0.0])).normalized()
     v = n.cross(u)
-    phi = 2 * math.pi * ti.random(ti.f32)
-    r = ti.random(ti.f32)
+    phi = 2 * math.pi * r1
+    r = r2
     ay = ti.sqrt(r)
     ax = ti.sqrt(1 - r)
     return ax * (ti.cos(phi) * u + ti.sin(phi) * v) + ay * n
@@ -45,6 +53,90 @@ def ray_aabb_intersection(box_min, box_max, o, d):
     return intersect, near_int, far_int
 
 
+@ti.func
+def ray_sphere_intersection(center, radius, o, d):
+    intersect = 1
+
+    near_int = inf
+    far_int = -inf
+
+    oc = o - center
+    b = oc.dot(d)
+    det = b * b - oc.dot(oc) + radius * radius
+    if det < 0:
+        intersect = 0
+    else:
+        sdet = ti.sqrt(det)
+        near_int = -b - sdet
+        far_int = -b + sdet
+    return intersect, near_int, far_int
+
+
+@ti.func
+def aabb_distance(box_min, box_max, p):
+    '''
+    Distance from p to the box (0 inside), a lower bound of the sdf of
+    anything inside it
+    '''
+    q = ti.max(box_min - p, p - box_max)
+    return ti.max(q, 0.).norm()
+
+
+@ti.func
+def pcg_hash(x):
+    '''
+    PCG RXS-M-XS hash of the u32 x
+    '''
+    state = ti.cast(x, ti.u32) * ti.u32(747796405) + ti.u32(2891336453)
+    word = ((state >> ((state >> ti.u32(28)) + ti.u32(4))) ^ state) * \
+        ti.u32(277803737)
+    return (word >> ti.u32(22)) ^ word
+
+
+@ti.func
+def reverse_bits(x):
+    x = ((x >> ti.u32(1)) & ti.u32(0x55555555)) | \
+        ((x & ti.u32(0x55555555)) << ti.u32(1))
+    x = ((x >> ti.u32(2)) & ti.u32(0x33333333)) | \
+        ((x & ti.u32(0x33333333)) << ti.u32(2))
+    x = ((x >> ti.u32(4)) & ti.u32(0x0F0F0F0F)) | \
+        ((x & ti.u32(0x0F0F0F0F)) << ti.u32(4))
+    x = ((x >> ti.u32(8)) & ti.u32(0x00FF00FF)) | \
+        ((x & ti.u32(0x00FF00FF)) << ti.u32(8))
+    return (x >> ti.u32(16)) | (x << ti.u32(16))
+
+
+@ti.func
+def nested_uniform_scramble(x, seed):
+    '''
+    Owen scrambling of the bits of the u32 x (Burley 2020, Laine-Karras
+    permutation)
+    '''
+    x = reverse_bits(x)
+    x += seed
+    x ^= x * ti.u32(0x6c50b47c)
+    x ^= x * ti.u32(0xb82f1e52)
+    x ^= x * ti.u32(0xc7afe638)
+    x ^= x * ti.u32(0x8d22f6e6)
+    return reverse_bits(x)
+
+
+@ti.func
+def sobol_2d(index):
+    '''
+    First two dimensions of the Sobol sequence as u32 fractions
+    '''
+    y = ti.u32(0)
+    v = ti.u32(0x80000000)
+    i = index
+    while i != 0:
+        if i & ti.u32(1):
+            y ^= v
+        i >>= ti.u32(1)
+        v ^= v >> ti.u32(1)
+    return reverse_bits(index), y
+
+
 def np_normalize(v):
     # https://stackoverflow.com/a/51512965/12003165
     return v / np.sqrt(np.sum(v**2))
@@ -0,0 +1,181 @@
+'''
+Triangle mesh of the scene sdf, written to PLY or OBJ.
+
+    python3 mesh.py mosley.py --depth 9 --output mosley.ply
+
+An octree is refined level by level from the bounding box, keeping only the
+cells the surface can cross (|sdf(center)| <= half diagonal), so the number
+of sdf evaluations and the memory grow with the surface area, not with the
+volume. The surface is then extracted from the leaves with surface nets
+(one vertex per leaf, moved onto the surface along the normal).
+'''
+import argparse
+import time
+import numpy as np
+
+import scene as scene_module
+from sdf_query import SDFQuery
+
+#corners of a cell, bit i of the index is the offset along axis i
+_CORNERS = np.array([[(c >> i) & 1 for i in range(3)] for c in range(8)])
+#the 12 edges of a cell as pairs of corner indices
+_EDGES = np.array([(c, c | 1 << a) for a in range(3) for c in range(8)
+                   if not c & 1 << a])
+
+
+def _keys(ijk, n):
+    return (ijk[:, 0] * n + ijk[:, 1]) * n + ijk[:, 2]
+
+
+def narrow_band_cells(query, box_min, size, depth, verbose=False):
+    '''
+    Integer coordinates of the leaves (2**depth per side of the cube of side
+    size at box_min) the surface can cross
+    '''
+    cells = np.zeros((1, 3), np.int64)
+    for level in range(depth + 1):
+        cell_size = size / 2**level
+        centers = box_min + (cells + 0.5) * cell_size
+        dist = query.evaluate(centers)
+        #the sdf is 1-Lipschitz: farther than the half diagonal, no surface
+        cells = cells[np.abs(dist) <= 0.5 * 3**0.5 * cell_size]
+        if verbose:
+            print(f"level {level}: {len(cells)} cells")
+        if level < depth:
+            cells = (2 * cells[:, None, :] + _CORNERS[None]).reshape(-1, 3)
+    return cells
+
+
+def surface_nets(query, cells, box_min, size, depth, project=True):
+    '''
+    Vertices (V, 3) and triangles (T, 3) of the surface crossing the leaves
+    cells
+    '''
+    n = 2**depth
+    cell_size = size / n
+    #sdf at the corners, evaluated once per corner shared by several cells
+    corners = (cells[:, None, :] + _CORNERS[None]).reshape(-1, 3)
+    corner_keys, first, inverse = np.unique(
+        _keys(corners, n + 1), return_index=True, return_inverse=True)
+    corner_dist = query.evaluate(box_min + corners[first] * cell_size)
+    dist = corner_dist[inverse.reshape(-1, 8)]
+
+    inside = dist < 0
+    active = inside.any(axis=1) & ~inside.all(axis=1)
+    cells, dist, inside = cells[active], dist[active], inside[active]
+
+    #vertex: average of the crossings of the cell edges
+    d0, d1 = dist[:, _EDGES[:, 0]], dist[:, _EDGES[:, 1]]
+    crossing = inside[:, _EDGES[:, 0]] != inside[:, _EDGES[:, 1]]
+    t = np.where(crossing, d0 / np.where(crossing, d0 - d1, 1), 0)
+    p0, p1 = _CORNERS[_EDGES[:, 0]], _CORNERS[_EDGES[:, 1]]
+    points = p0[None] + t[..., None] * (p1 - p0)[None]
+    local = (points * crossing[..., None]).sum(axis=1) / \
+        crossing.sum(axis=1)[:, None]
+    vertices = box_min + (cells + local) * cell_size
+    if project:
+        d, normals = query.evaluate(vertices, normals=True)
+        lo = box_min + cells * cell_size
+        #the normal is undefined (nan) where the gradient vanishes, e.g. on
+        #the symmetry planes of folding fractals: those vertices don't move
+        vertices = np.clip(vertices - np.nan_to_num(d[:, None] * normals),
+                           lo, lo + cell_size)
+
+    #a quad around each crossed edge whose 4 cells are all active, taking
+    #the edges from the lowest corner of each cell along each axis
+    cell_keys = _keys(cells, n)
+    order = np.argsort(cell_keys)
+    sorted_keys = cell_keys[order]
+    faces = []
+    for a in range(3):
+        b, c = (a + 1) % 3, (a + 2) % 3
+        crossed = inside[:, 0] != inside[:, 1 << a]
+        edge = cells[crossed]
+        flip = inside[crossed, 0]
+        quad = []
+        for db, dc in ((0, 0), (1, 0), (1, 1), (0, 1)):
+            neighbour = edge.copy()
+            neighbour[:, b] -= db
+            neighbour[:, c] -= dc
+            keys = _keys(neighbour, n)
+            i = np.minimum(np.searchsorted(sorted_keys, keys),
+                           len(sorted_keys) - 1)
+            found = (sorted_keys[i] == keys) & (neighbour >= 0).all(axis=1)
+            quad.append(np.where(found, order[i], -1))
+        quad = np.stack(quad, axis=1)
+        keep = (quad >= 0).all(axis=1)
+        quad, flip = quad[keep], flip[keep]
+        #normals pointing outside the surface
+        quad[~flip] = quad[~flip][:, ::-1]
+        faces += [quad[:, [0, 1, 2]], quad[:, [0, 2, 3]]]
+    return vertices.astype(np.float32), np.concatenate(faces).astype(np.int32)
+
+
+def extract_mesh(renderer, box_min, box_max, depth=8, project=True,
+                 verbose=False):
+    '''
+    Vertices and triangles of the surface of renderer.sdf inside the box,
+    at the resolution of a 2**depth grid over its largest side
+    '''
+    query = SDFQuery(renderer)
+    box_min = np.array(box_min, np.float64)
+    size = float((np.array(box_max, np.float64) - box_min).max())
+    #a margin of one finest cell: a surface touching the box would be cut
+    #open along its sides
+    pad = size / max(2**depth - 2, 1)
+    box_min -= pad
+    size += 2 * pad
+    cells = narrow_band_cells(query, box_min, size, depth, verbose)
+    return surface_nets(query, cells, box_min, size, depth, project)
+
+
+def write_mesh(fname, vertices, faces):
+    '''
+    Binary PLY, or OBJ when fname ends with .obj
+    '''
+    if fname.lower().endswith('.obj'):
+        with open(fname, 'w') as f:
+            np.savetxt(f, vertices, fmt='v %.6f %.6f %.6f')
+            np.savetxt(f, faces + 1, fmt='f %d %d %d')
+        return
+    header = (f"ply\nformat binary_little_endian 1.0\n"
+              f"element vertex {len(vertices)}\n"
+              "property float x\nproperty float y\nproperty float z\n"
+              f"element face {len(faces)}\n"
+              "property list uchar int vertex_indices\nend_header\n")
+    tri = np.zeros(len(faces), dtype=[('n', 'u1'), ('v', '<i4', 3)])
+    tri['n'] = 3
+    tri['v'] = faces
+    with open(fname, 'wb') as f:
+        f.write(header.encode('ascii'))
+        f.write(vertices.astype('<f4').tobytes())
+        f.write(tri.tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('script')
+    parser.add_argument('--depth', type=int, default=8,
+                        help='the finest grid has 2**depth cells per side')
+    parser.add_argument('--box', type=float, nargs=6, default=None,
+                        metavar=('X0', 'Y0', 'Z0', 'X1', 'Y1', 'Z1'),
+                        help='default: the bounding volumes of the scene')
+    parser.add_argument('--no-project', dest='project', action='store_false',
+                        help="don't move the vertices onto the surface")
+    parser.add_argument('--arch', choices=scene_module.ARCHS, default='cpu')
+    parser.add_argument('--output', default='mesh.ply')
+    args = parser.parse_args()
+
+    sc = scene_module.load_scene(args.script, arch=args.arch)
+    box_min, box_max = (args.box[:3], args.box[3:]) if args.box \
+        else sc._bounding_box()
+    t = time.time()
+    vertices, faces = extract_mesh(sc.renderer, box_min, box_max, args.depth,
+                                   args.project, verbose=True)
+    write_mesh(args.output, vertices, faces)
+    print(f"{len(vertices)} vertices, {len(faces)} triangles in "
+          f"{time.time() - t:.2f}s, saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -48,18 +48,12 @@ def rotation_matrix(axis, theta):
                      [2 * (bc - ad), aa + cc - bb - dd, 2 * (cd + ab)],
                      [2 * (bd + ac), 2 * (cd - ab), aa + dd - bb - cc]], ti.f32)
 
-#I you are wondering why the ti.field... stuff, it's because I was (still am) struggling with interactive modification using GUI
-MAX_ITER = 14
-MaxIter = ti.field(dtype=ti.f32, shape=())
-MaxIter[None] = MAX_ITER
-Offset = ti.Vector([1,1,0])
-Scale = ti.field(dtype=ti.f32, shape=())
-Scale[None] = 3.
-
-RotAngle = ti.field(dtype=ti.f32, shape=())
-RotAngle[None] = 0
-Rot = ti.Matrix([[1,0,0],[0,1,0],[0,0,1]], ti.f32)
-Rot = rotation_matrix(ti.Vector([0,1,0]), RotAngle[None] * math.pi / 180)
+#Parameters are uploaded to fields: changing them (see myGUI) doesn't recompile the SDF
+MaxIter = scene.add_parameter('MaxIter', 14)
+Offset = scene.add_parameter('Offset', (1., 1., 0.))
+Scale = scene.add_parameter('Scale', 3.)
+RotAngle = 0.
+Rot = scene.add_parameter('Rot', rotation_matrix(ti.Vector([0,1,0]), RotAngle * math.pi / 180))
 
 @ti.func
 def Mosley(p):
@@ -68,7 +62,8 @@ def Mosley(p):
     '''
     r2 = p.norm()
     dd = 1.
-    for i in range(MaxIter[None]): #(MAX_ITER) :
+    offset = Offset[None]
+    for i in range(MaxIter[None]):
         if p.dot(p) > 100. : break #if p.norm() > 10. : break
         #fold
         p = ti.abs(p)                               #fold along x,y and z axes
@@ -76,49 +71,38 @@ def Mosley(p):
         if p[1] < p[2] : p[1], p[2] = p[2], p[1] 
         if p[0] < p[1] : p[0], p[1] = p[1], p[0]
         #p[0] = ti.abs(p[0] - 1./3. * Offset[0]) + 1./3. * Offset[0]
-        p[1] = ti.abs(p[1] - 1./3. * Offset[1]) + 1./3. * Offset[1]
+        p[1] = ti.abs(p[1] - 1./3. * offset[1]) + 1./3. * offset[1]
         #p[2] = ti.abs(p[2] - 1./3. * Offset[2]) + 1./3. * Offset[2]
 
-        p = p * Scale[None] - Offset * (Scale[None] -1.)
+        p = p * Scale[None] - offset * (Scale[None] -1.)
         dd*= Scale[None]
-        p = Rot @ p
+        p = Rot[None] @ p
     #using that boxDE gives nicer results at low iteration count
     return (boxDE(p, 1.)-0.) / dd
 
 #the SDF and color functions are called from the renderer so let's tell it which functions to use.
 scene.set_sdf_func(Mosley)
 scene.set_sdf_col(My_SDF_col)
+#rays outside of this box are not marched. The fractal only stays inside its
+#first box (+-1) without rotation: the box bounds it for every value of the
+#sliders (rotated, it reaches about +-1.6 at low scales)
+scene.add_bounding_box((-2., -2., -2.), (2., 2., 2.))
 
 #help preserving your GC: set it to something like 1000 if you want a high quality / lower noise results
 scene.maxSamples = 100
 
-#trying GUI
-##Works but much slower so it is deactivated. See also scene.finish() in scene.py
-###BTW! rotation matrix doesn't work.
+#GUI: the sliders only upload parameters, see Scene.add_parameter()
 def myGUI(win):
-    Modified = False
+    global RotAngle
     win.GUI.begin("Mosley fractal", 0.05, 0.05, 0.3, 0.2)
     win.GUI.text("Simple IFS and kaleidoscopic fractal")
-    win.GUI.button("bla")
-    RotAngle[None] = win.GUI.slider_float("Angle",RotAngle[None],0,360)
-    
-    amxitr = ti.field(dtype=ti.f32, shape=())
-    amxitr[None] = MaxIter[None]
-    MaxIter[None] = ti.round( win.GUI.slider_float("Max iterations",amxitr[None],0,20) )
-    if amxitr[None]!=MaxIter[None]: Modified = True
-    
-    ascl = ti.field(dtype=ti.f32, shape=())
-    ascl[None] = Scale[None]
-    Scale[None] = win.GUI.slider_float("Scale",ascl[None],1.1,3)
-    if ascl[None]!=Scale[None]: Modified = True
-
+    RotAngle = win.GUI.slider_float("Angle", RotAngle, 0, 360)
+    scene.set_parameter('Rot', rotation_matrix(ti.Vector([0,1,0]), RotAngle * math.pi / 180))
+    scene.set_parameter('MaxIter', win.GUI.slider_int("Max iterations", scene.get_parameter('MaxIter'), 0, 20))
+    scene.set_parameter('Scale', win.GUI.slider_float("Scale", scene.get_parameter('Scale'), 1.1, 3))
     win.GUI.end()
 
-    Rot = rotation_matrix(ti.Vector([0,1,0]), RotAngle[None] * math.pi / 180)
-
-    return False #Modified
-
 #tell scene which GUI callback to use
-#scene.setGUICB(myGUI)
+scene.setGUICB(myGUI)
 
 scene.finish()
@@ -0,0 +1,136 @@
+'''
+Renders one image with a pool of processes, each running its own ti.cpu
+Renderer on a scene script (example.py, mosley.py...).
+
+    python3 parallel.py mosley.py --processes 8 --spp 1024 --split samples --output mosley.png
+
+The image is split in tiles (--split tiles) or the samples in ranges
+(--split samples); the partial color buffers are summed. Random numbers come
+from the 'hash' sampler so the result only depends on --seed, not on the
+split nor on the number of processes.
+'''
+import argparse
+import multiprocessing
+import os
+import time
+import numpy as np
+import taichi as ti
+import scene as scene_module
+
+_worker_scene = None
+
+
+def _init_worker(script, res, threads, seed, cpus):
+    global _worker_scene
+    if cpus is not None and hasattr(os, 'sched_setaffinity'):
+        #keep the workers (and their memory) on their own cores
+        worker = multiprocessing.current_process()._identity[0] - 1
+        os.sched_setaffinity(0, cpus[worker % len(cpus)])
+    _worker_scene = load_parallel_scene(script, res, threads, seed)
+
+
+def load_parallel_scene(script, res, threads=None, seed=0):
+    sc = scene_module.load_scene(script, arch='cpu', threads=threads,
+                                 res=res)
+    sc.set_sampler('hash', seed)
+    #the samples of a pixel may be spread over several processes
+    sc.renderer.adaptive_threshold = 0
+    sc.renderer.temporal_max_history = 0
+    sc.renderer.denoiser_settings = None
+    sc.renderer.set_camera_pos(*sc.camera.position)
+    sc.renderer.set_look_at(*sc.camera.look_at)
+    return sc
+
+
+def _render_task(task):
+    '''
+    Renders the samples first..last - 1 of the pixels in window
+    Returns the window and its summed colors.
+    '''
+    (x0, y0, x1, y1), (first, last) = task
+    renderer = _worker_scene.renderer
+    renderer.set_window(x0, y0, x1, y1)
+    renderer.reset_framebuffer()
+    renderer.sample_offset = first
+    for _ in range(last - first):
+        renderer.accumulate()
+    return task[0], renderer.color_buffer.to_numpy()[x0:x1, y0:y1]
+
+
+def split_tasks(res, spp, split, parts):
+    '''
+    parts tiles (rows of the image) rendered with all the samples, or parts
+    sample ranges of the whole image
+    '''
+    w, h = res
+    if split == 'tiles':
+        bounds = np.linspace(0, h, parts + 1).astype(int)
+        return [((0, y0, w, y1), (0, spp))
+                for y0, y1 in zip(bounds[:-1], bounds[1:]) if y1 > y0]
+    bounds = np.linspace(0, spp, parts + 1).astype(int)
+    return [((0, 0, w, h), (s0, s1))
+            for s0, s1 in zip(bounds[:-1], bounds[1:]) if s1 > s0]
+
+
+def cpu_sets(processes):
+    '''
+    Contiguous blocks of the available cores, one per process (cores of a
+    NUMA node are usually numbered contiguously)
+    '''
+    if not hasattr(os, 'sched_getaffinity'):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    n = max(len(cpus) // processes, 1)
+    return [set(cpus[i * n:(i + 1) * n]) or set(cpus)
+            for i in range(processes)]
+
+
+def render_parallel(script, res, spp, processes=None, split='tiles',
+                    seed=0, tasks_per_process=4, pin=False):
+    '''
+    Returns the summed color buffer (res[0] x res[1] x 3) of spp samples
+    '''
+    processes = processes or os.cpu_count()
+    threads = max(os.cpu_count() // processes, 1)
+    tasks = split_tasks(res, spp, split, processes * tasks_per_process)
+    color = np.zeros((res[0], res[1], 3), np.float32)
+    #taichi runtimes can't be forked
+    ctx = multiprocessing.get_context('spawn')
+    cpus = cpu_sets(processes) if pin else None
+    with ctx.Pool(processes, _init_worker,
+                  (script, res, threads, seed, cpus)) as pool:
+        for (x0, y0, x1, y1), part in pool.imap_unordered(_render_task,
+                                                          tasks):
+            color[x0:x1, y0:y1] += part
+    return color
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('script')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--spp', type=int, default=64)
+    parser.add_argument('--res', type=scene_module._parse_res,
+                        default=scene_module.SCREEN_RES)
+    parser.add_argument('--split', choices=('tiles', 'samples'),
+                        default='tiles')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pin', action='store_true',
+                        help='pin each process to its own block of cores')
+    parser.add_argument('--output', default='render.png')
+    args = parser.parse_args()
+
+    t = time.time()
+    color = render_parallel(args.script, args.res, args.spp, args.processes,
+                            args.split, args.seed, pin=args.pin)
+    #tonemapping with the scene's own settings
+    sc = load_parallel_scene(args.script, args.res, 1, args.seed)
+    sc.renderer.color_buffer.from_numpy(color)
+    sc.renderer.current_spp = args.spp
+    ti.tools.image.imwrite(sc.renderer.fetch_image(), args.output)
+    print(f"Rendered {args.spp} spp in {time.time() - t:.2f}s, "
+          f"saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+'''
+Timings of the phases of the frames of the Scene loop (camera update,
+accumulate, tonemapping, presentation, I/O), with rolling statistics and a
+Chrome trace export (open it in chrome://tracing or https://ui.perfetto.dev):
+
+    python3 mosley.py --profile trace.json
+
+Each phase is bracketed by ti.sync() so that it gets the time of its own
+kernels. With kernels=True (needs ti.init(kernel_profiler=True)) the kernel
+timings of Taichi's profiler are recorded too.
+'''
+import collections
+import contextlib
+import json
+import re
+import time
+import numpy as np
+import taichi as ti
+from taichi.lang import impl
+
+#offloaded task names, e.g. render_c80_0_kernel_2_range_for
+_TASK_NAME = re.compile(r'^(.*?)(_c\d+)?(_\d+)?_kernel_\d+_\w+$')
+#trace rows
+_FRAMES_TID, _KERNELS_TID = 0, 1
+
+
+class FrameProfiler:
+    def __init__(self, sync=True, kernels=False, history=120):
+        '''
+        history: number of last values of each phase the statistics are
+        computed on
+        '''
+        self.sync = sync
+        self.kernels = kernels
+        self.history = history
+        self.frame = 0
+        self.events = []  # Chrome trace events
+        self._durations = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.history))
+        self._t0 = time.perf_counter()
+
+    def _us(self, t):
+        return (t - self._t0) * 1e6
+
+    def _add(self, name, start, duration, tid, category, args=None):
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': 0,
+                 'tid': tid, 'ts': self._us(start), 'dur': duration * 1e6}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        '''
+        Times the block as the phase name of the current frame
+        '''
+        if self.sync:
+            ti.sync()
+        if self.kernels:
+            self._clear_kernels()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.sync:
+                ti.sync()
+            end = time.perf_counter()
+            self._add(name, start, end - start, _FRAMES_TID, 'phase')
+            self._durations[name].append(end - start)
+            if self.kernels:
+                self._record_kernels(start)
+
+    @contextlib.contextmanager
+    def frame_scope(self):
+        '''
+        Times the block as a whole frame, whose phases are timed with
+        phase()
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self._add('frame', start, end - start, _FRAMES_TID, 'frame',
+                      {'frame': self.frame})
+            self._durations['frame'].append(end - start)
+            self.frame += 1
+
+    def _clear_kernels(self):
+        impl.get_runtime().prog.clear_kernel_profiler()
+
+    def _record_kernels(self, start):
+        '''
+        Kernels launched since the phase started. The CPU backend only gives
+        their durations: they are laid out one after the other from start.
+        '''
+        prog = impl.get_runtime().prog
+        prog.sync_kernel_profiler()
+        prog.update_kernel_profiler()
+        t = start
+        totals = collections.defaultdict(float)
+        for record in prog.get_kernel_profiler_records():
+            match = _TASK_NAME.match(record.name)
+            name = f"kernel {match.group(1) if match else record.name}"
+            duration = record.kernel_time * 1e-3
+            self._add(name, t, duration, _KERNELS_TID, 'kernel',
+                      {'task': record.name})
+            totals[name] += duration
+            t += duration
+        for name, duration in totals.items():
+            self._durations[name].append(duration)
+        self._clear_kernels()
+
+    def stats(self):
+        '''
+        {name: {'mean', 'p50', 'p95', 'max' (ms), 'count'}} over the last
+        history frames, phases, and kernels (summed over their tasks)
+        '''
+        result = {}
+        for name, durations in self._durations.items():
+            ms = np.array(durations) * 1e3
+            result[name] = {'mean': float(ms.mean()),
+                            'p50': float(np.percentile(ms, 50)),
+                            'p95': float(np.percentile(ms, 95)),
+                            'max': float(ms.max()),
+                            'count': len(ms)}
+        return result
+
+    def report(self):
+        lines = [f"{'':32s} {'mean':>9s} {'p50':>9s} {'p95':>9s} {'max':>9s}"
+                 " (ms)"]
+        for name, s in sorted(self.stats().items(),
+                              key=lambda item: -item[1]['mean']):
+            lines.append(f"{name[:32]:32s} {s['mean']:9.3f} {s['p50']:9.3f} "
+                         f"{s['p95']:9.3f} {s['max']:9.3f}")
+        return '\n'.join(lines)
+
+    def save(self, path):
+        '''
+        Writes the events as Chrome trace JSON
+        '''
+        names = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid,
+                  'args': {'name': name}}
+                 for tid, name in ((_FRAMES_TID, 'frames'),
+                                   (_KERNELS_TID, 'kernels'))]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': names + self.events,
+                       'displayTimeUnit': 'ms'}, f)
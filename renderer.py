@@ -1,6 +1,13 @@
+import copy
+import numpy as np
 import taichi as ti
 
-from math_utils import (eps, inf, out_dir, ray_aabb_intersection)
+from denoiser import Denoiser
+from stats import EXIT_HIT, EXIT_LIMIT, EXIT_STEP_CAP, RenderStats
+from wavefront import Wavefront
+from math_utils import (eps, inf, cosine_dir, nested_uniform_scramble,
+                        pcg_hash, ray_aabb_intersection,
+                        ray_sphere_intersection, sobol_2d)
 
 @ti.func
 def default_SDF(o):
@@ -12,14 +19,41 @@ def default_SDF(o):
 def default_SDF_color(o, n):
     return ti.Vector([0.1, 0.5, 0.3])
 
+NORMAL_STRATEGIES = ('forward', 'central', 'tetrahedral')
+#'random': ti.random(), 'hash': reproducible random numbers that only
+#depend on the seed, the pixel and the sample index, 'sobol': the same but
+#low-discrepancy (Owen scrambled Sobol points per pixel)
+SAMPLERS = ('random', 'hash', 'sobol')
+#'megakernel': render(), 'wavefront': see wavefront.py
+PIPELINES = ('megakernel', 'wavefront')
+
 MAX_RAY_DEPTH = 2
 use_directional_light = True
 
 DIS_LIMIT = 20
+#bits of the 'sobol' generator state counting the dimensions of a sample,
+#enough for the camera ray and 6 per bounce
+SOBOL_DIM_BITS = 5
 
 
 @ti.data_oriented
 class Renderer:
+    #Scene settings, copied by clone()
+    _setting_fields = ('fov', 'light_direction', 'light_direction_noise',
+                       'light_color', 'camera_pos', 'look_at', 'up',
+                       'floor_height', 'floor_color', 'background_color',
+                       'ambient_color')
+    _setting_attrs = ('vignette_strength', 'vignette_radius',
+                      'vignette_center', 'sdf', 'sdf_color',
+                      'ray_march_sdf_steps', 'ray_march_relaxation',
+                      'normal_strategy', 'normal_epsilon',
+                      'bounding_volumes', 'sdf_cache', 'prepass_tile',
+                      'adaptive_threshold', 'adaptive_tile',
+                      'adaptive_min_spp', 'denoiser_settings',
+                      'temporal_max_history', 'temporal_tolerance',
+                      'sampler', 'seed', 'sdf_parameters', 'pipeline',
+                      'shadow_softness', 'planes', 'collect_stats')
+
     def __init__(self, image_res, up, exposure=3):
         self.image_res = image_res
         self.aspect_ratio = image_res[0] / image_res[1]
@@ -59,6 +93,93 @@ class Renderer:
         self.sdf = default_SDF
         self.sdf_color = default_SDF_color
         self.ray_march_sdf_steps = 100
+        self.ray_march_relaxation = 1
+        self.normal_strategy = 'forward'
+        self.normal_epsilon = 1e-4
+        #analytic occluders besides the floor: (normal, offset, color) of
+        #half spaces normal . p <= offset, see analytic_hit()
+        self.planes = []
+        #('box', min, max) or ('sphere', center, radius), see ray_bounds()
+        self.bounding_volumes = []
+        self.sdf_cache = None  # SDFCache, shared by clones
+        #tile size in pixels of the depth prepass, 0 to disable it
+        self.prepass_tile = 0
+        self._prepass_dist = None
+        self._prepass_dirty = True
+        #adaptive sampling: tiles whose relative noise is below
+        #adaptive_threshold stop getting samples, 0 to disable it
+        self.adaptive_threshold = 0.
+        self.adaptive_tile = 16
+        self.adaptive_min_spp = 16
+        self.coverage = 1.  # fraction of the pixels still sampled
+        self._sample_count = None
+        self._lum_sq_buffer = None
+        #temporal reprojection: how many samples of a pixel are kept when
+        #the camera moves (see reproject_framebuffer()), 0 to disable it
+        self.temporal_max_history = 0
+        self.temporal_tolerance = 0.02
+        self._hit_pos = None
+        self.sampler = 'random'
+        self.seed = 0
+        #index of the first sample of the framebuffer, see accumulate()
+        self.sample_offset = 0
+        self._sample_index = ti.field(dtype=ti.i32, shape=())
+        #pixels rendered: x0, y0, x1, y1 (of the scaled color_buffer)
+        self._window = ti.Vector.field(4, dtype=ti.i32, shape=())
+        self._window[None] = (0, 0, image_res[0], image_res[1])
+        #the image is rendered at image_res / resolution_scale then upsampled
+        self.resolution_scale = 1
+        self._scale = ti.field(dtype=ti.i32, shape=())
+        self._scale[None] = 1
+        #0-d fields read by the sdf, see add_parameter(). Shared by clones
+        self.sdf_parameters = {}
+        #the accumulated samples are stale, accumulate() starts over
+        self.framebuffer_dirty = False
+        self.pipeline = 'megakernel'
+        #0: hard shadows, soft ones come from light_direction_noise
+        #k > 0: penumbra estimated by the shadow ray (larger: sharper)
+        self.shadow_softness = 0.
+        self.wavefront = None
+        #per pixel cost counters (RenderStats), compiled out when False
+        self.collect_stats = False
+        self.stats = None
+        #'color' or one of stats.HEATMAPS, shown by fetch_image()
+        self.display = 'color'
+        #Denoiser arguments, the Denoiser is created on first render
+        self.denoiser_settings = None
+        self.denoiser = None
+
+    def clone(self, image_res=None):
+        '''
+        Returns a new Renderer with the same scene settings, optionally at
+        another resolution. Its kernels are compiled on first use so
+        attributes like sdf can still be changed.
+        '''
+        r = Renderer(self.image_res if image_res is None else image_res,
+                     self.up[None], self.exposure)
+        for name in self._setting_attrs:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                value = copy.copy(value)
+            setattr(r, name, value)
+        for name in self._setting_fields:
+            getattr(r, name)[None] = getattr(self, name)[None]
+        return r
+
+    @property
+    def use_sdf_cache(self):
+        return self.sdf_cache is not None
+
+    @property
+    def use_denoiser(self):
+        return self.denoiser_settings is not None
+
+    @property
+    def use_sample_count(self):
+        '''
+        Whether the pixels have their own number of samples
+        '''
+        return self.adaptive_threshold > 0 or self.temporal_max_history > 0
 
     def set_directional_light(self, direction, light_direction_noise,
                               light_color):
@@ -84,17 +205,175 @@ class Renderer:
         return dist
     
     @ti.func
-    def ray_march_sdf(self,p, d):
+    def analytic_hit(self, p, d):
+        '''
+        Closest of the analytic occluders (floor and planes) hit by the ray.
+        Returns its distance (inf if none) and index in planes (-1: floor).
+        '''
+        closest = self.ray_march_floor(p, d)
+        hit = -1
+        for i in ti.static(range(len(self.planes))):
+            normal, offset, _ = ti.static(self.planes[i])
+            n = ti.Vector(normal)
+            dn = d.dot(n)
+            if dn < -eps:
+                dist = (offset - p.dot(n)) / dn
+                if dist >= 0 and dist < closest:
+                    closest = dist
+                    hit = i
+        return closest, hit
+
+    @ti.func
+    def get_analytic_normal_color(self, p, hit):
+        normal = self.get_floor_normal(p)
+        c = self.get_floor_color(p)
+        for i in ti.static(range(len(self.planes))):
+            n, _, color = ti.static(self.planes[i])
+            if hit == i:
+                normal = ti.Vector(n)
+                c = ti.Vector(color)
+        return normal, c
+
+    @ti.func
+    def ray_bounds(self, p, d):
+        '''
+        Interval of the ray where the sdf can be hit, according to the
+        bounding volumes the user declared (whole ray when there is none).
+        An empty interval (start >= end) means the ray misses them all.
+        '''
+        start = 0.0
+        end = ti.cast(DIS_LIMIT, ti.f32)
+        if ti.static(len(self.bounding_volumes) > 0):
+            start = inf
+            end = 0.0
+            for i in ti.static(range(len(self.bounding_volumes))):
+                kind, a, b = ti.static(self.bounding_volumes[i])
+                intersect, near, far = 0, 0.0, 0.0
+                if ti.static(kind == 'box'):
+                    intersect, near, far = ray_aabb_intersection(
+                        ti.Vector(a), ti.Vector(b), p, d)
+                else:
+                    intersect, near, far = ray_sphere_intersection(
+                        ti.Vector(a), b, p, d)
+                if intersect and far > 0:
+                    start = min(start, ti.max(near, 0.0))
+                    end = ti.max(end, far)
+            end = min(end, DIS_LIMIT)
+        return start, end
+
+    @ti.func
+    def cached_sdf(self, p):
+        '''
+        The sdf, or a lower bound of it from sdf_cache when it allows a step
+        larger than a cache cell. Also returns 1 when the sdf was evaluated.
+        '''
+        s = 0.0
+        evaluated = 1
+        if ti.static(self.use_sdf_cache):
+            s = self.sdf_cache.lower_bound(p)
+            if s <= self.sdf_cache.cell_edge:
+                s = self.sdf(p)
+            else:
+                evaluated = 0
+        else:
+            s = self.sdf(p)
+        return s, evaluated
+
+    @ti.func
+    def ray_march_sdf(self,p, d, start, limit):
         '''
         Sphere tracing the scene represented in self.sdf().
         self.sdf() is provided by the user.
+        The sdf is evaluated once per step. With ray_march_relaxation > 1
+        the steps are over-relaxed (enhanced sphere tracing), falling back
+        to plain steps as soon as two unbounding spheres don't overlap.
+        The march starts at distance start, stops at limit and is clipped to
+        the bounding volumes, see ray_bounds().
+        Far from the surface the steps come from sdf_cache when there is one.
+        Returns the distance and the sdf value there when the march stopped
+        on the surface (inf otherwise), which get_sdf_normal() can reuse,
+        and its cost (steps, sdf evaluations, exit) for RenderStats.
         '''
         j = 0
-        dist = 0.0
-        while j < self.ray_march_sdf_steps and self.sdf(p + dist * d) > 1e-4 * dist and dist < DIS_LIMIT : #inf:
-            dist += self.sdf(p + dist * d)
+        evals = 0
+        dist, end = self.ray_bounds(p, d)
+        dist = ti.max(dist, start)
+        end = ti.min(end, limit)
+        last = inf
+        if ti.static(self.ray_march_relaxation == 1):
+            while j < self.ray_march_sdf_steps and dist < end:
+                s, evaluated = self.cached_sdf(p + dist * d)
+                evals += evaluated
+                if s <= 1e-4 * dist:
+                    last = s
+                    break
+                dist += s
+                j += 1
+        else:
+            omega = ti.cast(self.ray_march_relaxation, ti.f32)
+            step = 0.0
+            prev_s = 0.0
+            while j < self.ray_march_sdf_steps and dist < end:
+                s, evaluated = self.cached_sdf(p + dist * d)
+                evals += evaluated
+                if omega > 1 and ti.abs(s) + prev_s < step:
+                    #overstepped: go back to the plain sphere tracing step
+                    dist -= step - step / omega
+                    omega = 1.0
+                else:
+                    if s <= 1e-4 * dist:
+                        last = s
+                        break
+                    prev_s = s
+                    step = s * omega
+                    dist += step
+                j += 1
+        stop = EXIT_STEP_CAP
+        if last < inf:
+            stop = EXIT_HIT
             j += 1
-        return min(inf, dist)
+        elif dist >= end:
+            stop = EXIT_LIMIT
+            dist = inf
+        return dist, last, ti.Vector([j, evals, stop])
+
+    @ti.func
+    def light_visibility(self, p, d):
+        '''
+        Fraction of the directional light reaching p from direction d: 0 or
+        1, or the penumbra estimate min(k * sdf / distance) along the ray
+        when shadow_softness = k > 0 (Quilez).
+        Only looks for occluders, exits on the first one.
+        Also returns the cost of the march, see ray_march_sdf().
+        '''
+        visibility = 1.0
+        cost = ti.Vector([0, 0, -1])
+        if self.analytic_hit(p, d)[0] < DIS_LIMIT:
+            visibility = 0.0
+        elif ti.static(self.shadow_softness > 0):
+            k = ti.static(self.shadow_softness)
+            start, end = self.ray_bounds(p, d)
+            dist = ti.max(start, 1e-3)
+            j = 0
+            cost[2] = EXIT_STEP_CAP
+            while j < self.ray_march_sdf_steps and dist < end:
+                s = self.sdf(p + dist * d)
+                j += 1
+                if s <= 1e-4 * dist:
+                    visibility = 0.0
+                    cost[2] = EXIT_HIT
+                    break
+                visibility = ti.min(visibility, k * s / dist)
+                dist += s
+            if dist >= end:
+                cost[2] = EXIT_LIMIT
+            cost[0] = j
+            cost[1] = j
+        else:
+            dist, _, cost = self.ray_march_sdf(p, d, 0.0, DIS_LIMIT)
+            if dist < DIS_LIMIT:
+                visibility = 0.0
+        return visibility, cost
 
     @ti.func
     def get_floor_normal(self, p):
@@ -105,81 +384,303 @@ class Renderer:
         return self.floor_color[None]
 
     @ti.func
-    def get_sdf_normal(self, p):
+    def get_sdf_normal(self, p, t, center):
         '''
-        Computes the sdf's normal at p
+        Computes the sdf's normal at p, t away from the ray origin.
+        The finite differences step grows with t (normal_epsilon up to t=1).
+        center is the sdf at p when known (see ray_march_sdf()), else inf.
+        normal_strategy is one of:
+        'forward': 3 taps (4 when center is unknown)
+        'central': 6 taps
+        'tetrahedral': 4 taps, more accurate than forward
         '''
-        d = 1e-4
+        d = self.normal_epsilon * ti.max(t, 1.0)
         n = ti.Vector([0.0, 0.0, 0.0])
-        sdf_center = self.sdf(p)
-        for i in ti.static(range(3)):
-            inc = p
-            inc[i] += d
-            n[i] = (1 / d) * (self.sdf(inc) - sdf_center)
+        if ti.static(self.normal_strategy == 'tetrahedral'):
+            k = ti.Vector([1.0, -1.0])
+            for e in ti.static([k.xyy, k.yyx, k.yxy, k.xxx]):
+                n += e * self.sdf(p + d * e)
+        elif ti.static(self.normal_strategy == 'central'):
+            for i in ti.static(range(3)):
+                inc = p
+                inc[i] += d
+                dec = p
+                dec[i] -= d
+                n[i] = self.sdf(inc) - self.sdf(dec)
+        else:
+            sdf_center = center
+            if sdf_center >= inf:
+                sdf_center = self.sdf(p)
+            for i in ti.static(range(3)):
+                inc = p
+                inc[i] += d
+                n[i] = (1 / d) * (self.sdf(inc) - sdf_center)
         return n.normalized()
 
+    @ti.func
+    def normal_taps(self, center):
+        '''
+        Number of sdf evaluations of get_sdf_normal()
+        '''
+        taps = 3
+        if ti.static(self.normal_strategy == 'tetrahedral'):
+            taps = 4
+        elif ti.static(self.normal_strategy == 'central'):
+            taps = 6
+        elif center >= inf:
+            taps = 4
+        return taps
+
     @ti.func
     def get_sdf_color(self, p, n):
         return self.sdf_color(p,n) # self.floor_color[None]
 
     @ti.func
     def next_hit(self, pos, d, t):
-        closest = inf
+        '''
+        t: distance along the ray known to be free of sdf surface
+        The analytic occluders are intersected first and cap the sdf march,
+        the normal and color are only computed for the closest hit.
+        Also returns the cost of the ray, see ray_march_sdf().
+        '''
         normal = ti.Vector([0.0, 0.0, 0.0])
         c = ti.Vector([0.0, 0.0, 0.0])
         hit_light = 0
 
-        #sdf
-        ray_march_dist = self.ray_march_sdf(pos, d)
+        closest, hit = self.analytic_hit(pos, d)
+        ray_march_dist, sdf_end, cost = self.ray_march_sdf(
+            pos, d, t, ti.min(closest, DIS_LIMIT))
         if ray_march_dist < DIS_LIMIT and ray_march_dist < closest:
             closest = ray_march_dist
-            normal = self.get_sdf_normal(pos + d * closest)
+            normal = self.get_sdf_normal(pos + d * closest, closest, sdf_end)
             c = self.get_sdf_color(pos + d * closest, normal)
+            cost[1] += self.normal_taps(sdf_end)
+        elif closest < DIS_LIMIT:
+            normal, c = self.get_analytic_normal_color(pos + d * closest, hit)
+        else:
+            closest = inf
 
-        #floor
-        ray_march_dist = self.ray_march_floor(pos, d)
-        if ray_march_dist < DIS_LIMIT and ray_march_dist < closest:
-            closest = ray_march_dist
-            normal = self.get_floor_normal(pos + d * closest)
-            c = self.get_floor_color(pos + d * closest)
+        return closest, normal, c, hit_light, cost
+
+    def set_camera_pos(self, x, y, z):
+        self._set_camera_pos(x, y, z)
+        self._prepass_dirty = True
+
+    def set_up(self, x, y, z):
+        self._set_up(x, y, z)
+        self._prepass_dirty = True
 
-        return closest, normal, c, hit_light
+    def set_look_at(self, x, y, z):
+        self._set_look_at(x, y, z)
+        self._prepass_dirty = True
+
+    def set_fov(self, fov):
+        self._set_fov(fov)
+        self._prepass_dirty = True
+
+    def add_parameter(self, name, value):
+        '''
+        Returns a 0-d field (scalar, vector or matrix, i32 for integers) set
+        to value. The sdf and color functions read it as field[None] so that
+        set_parameter() changes the scene without recompiling the kernels.
+        '''
+        if name in self.sdf_parameters:
+            raise ValueError(f"Parameter {name} already exists")
+        a = _parameter_array(value)
+        dtype = ti.i32 if np.issubdtype(a.dtype, np.integer) else ti.f32
+        if a.ndim == 0:
+            field = ti.field(dtype=dtype, shape=())
+        elif a.ndim == 1:
+            field = ti.Vector.field(a.shape[0], dtype=dtype, shape=())
+        elif a.ndim == 2:
+            field = ti.Matrix.field(a.shape[0], a.shape[1], dtype=dtype,
+                                    shape=())
+        else:
+            raise ValueError(f"Parameter {name} should be a scalar, a "
+                             "vector or a matrix")
+        field[None] = a.tolist()
+        self.sdf_parameters[name] = field
+        return field
+
+    def get_parameter(self, name):
+        value = self.sdf_parameters[name][None]
+        return value.to_numpy() if hasattr(value, 'to_numpy') else value
+
+    def set_parameter(self, name, value):
+        '''
+        Uploads value to the parameter field if it changed, the caches and
+        the accumulated samples are then rebuilt (no recompilation).
+        Returns whether it changed.
+        '''
+        field = self.sdf_parameters[name]
+        #compared at the precision of the field: a float64 value that isn't
+        #exactly representable would always look changed
+        dtype = np.int32 if field.dtype == ti.i32 else np.float32
+        a = _parameter_array(value).astype(dtype)
+        if np.array_equal(a, _parameter_array(self.get_parameter(name))):
+            return False
+        field[None] = a.tolist()
+        if self.sdf_cache is not None:
+            self.sdf_cache.invalidate()
+        self._prepass_dirty = True
+        self.framebuffer_dirty = True
+        return True
 
     @ti.kernel
-    def set_camera_pos(self, x: ti.f32, y: ti.f32, z: ti.f32):
+    def _set_camera_pos(self, x: ti.f32, y: ti.f32, z: ti.f32):
         self.camera_pos[None] = ti.Vector([x, y, z])
 
     @ti.kernel
-    def set_up(self, x: ti.f32, y: ti.f32, z: ti.f32):
+    def _set_up(self, x: ti.f32, y: ti.f32, z: ti.f32):
         self.up[None] = ti.Vector([x, y, z]).normalized()
 
     @ti.kernel
-    def set_look_at(self, x: ti.f32, y: ti.f32, z: ti.f32):
+    def _set_look_at(self, x: ti.f32, y: ti.f32, z: ti.f32):
         self.look_at[None] = ti.Vector([x, y, z])
 
     @ti.kernel
-    def set_fov(self, fov: ti.f32):
+    def _set_fov(self, fov: ti.f32):
         self.fov[None] = fov
 
     @ti.func
-    def get_cast_dir(self, u, v):
+    def get_light_dir(self, r1, r2, r3):
+        '''
+        Direction of the directional light, jittered by
+        light_direction_noise with the random numbers r1, r2, r3 unless
+        soft shadows are estimated
+        '''
+        d = self.light_direction[None]
+        if ti.static(self.shadow_softness == 0):
+            d += ti.Vector([r1 - 0.5, r2 - 0.5, r3 - 0.5]) * \
+                self.light_direction_noise[None]
+        return d.normalized()
+
+    @ti.func
+    def start_sampling(self, u, v):
+        '''
+        Random number generator state of the current sample of the pixel
+        u, v, see next_random()
+        '''
+        rng = ti.u32(0)
+        if ti.static(self.sampler == 'hash'):
+            rng = pcg_hash(ti.u32(self.seed) ^ pcg_hash(
+                u + pcg_hash(v + pcg_hash(self._sample_index[None]))))
+        elif ti.static(self.sampler == 'sobol'):
+            #scramble of the pixel, the low bits count the dimensions used
+            rng = pcg_hash(ti.u32(self.seed) ^ pcg_hash(u + pcg_hash(v))) << \
+                ti.u32(SOBOL_DIM_BITS)
+        return rng
+
+    @ti.func
+    def next_random(self, rng):
+        '''
+        Uniform number in [0, 1) and the new state of the generator
+        '''
+        x = 0.0
+        if ti.static(self.sampler == 'hash'):
+            rng = pcg_hash(rng)
+            x = ti.cast(rng >> ti.u32(8), ti.f32) * (1.0 / 16777216.0)
+        elif ti.static(self.sampler == 'sobol'):
+            #dimensions 2k, 2k + 1 are a 2D Sobol sequence indexed by the
+            #sample, shuffled and scrambled differently for each k (Burley
+            #2020), so that each pair is stratified, e.g. the pixel area,
+            #the bounce directions and the light jitter
+            dim = rng & ti.u32((1 << SOBOL_DIM_BITS) - 1)
+            pair_seed = pcg_hash(rng - dim + (dim >> ti.u32(1)))
+            index = nested_uniform_scramble(
+                ti.cast(self._sample_index[None], ti.u32), pair_seed)
+            x0, x1 = sobol_2d(index)
+            y = x0 if dim & ti.u32(1) == 0 else x1
+            y = nested_uniform_scramble(
+                y, pcg_hash(pair_seed + ti.u32(1) + (dim & ti.u32(1))))
+            x = ti.cast(y >> ti.u32(8), ti.f32) * (1.0 / 16777216.0)
+            rng += ti.u32(1)
+        else:
+            x = ti.random(ti.f32)
+        return x, rng
+
+    @ti.func
+    def get_cast_dir(self, u, v, rng):
+        '''
+        Random direction through the pixel u, v of the (scaled) color_buffer
+        '''
+        k = self._scale[None]
+        ru, rng = self.next_random(rng)
+        rv, rng = self.next_random(rng)
+        return self.get_pixel_dir((u + ru) * k, (v + rv) * k), rng
+
+    @ti.func
+    def get_pixel_dir(self, u, v):
+        '''
+        Direction of the ray through the (fractional) pixel coordinates u, v
+        '''
         fov = self.fov[None]
         d = (self.look_at[None] - self.camera_pos[None]).normalized()
-        fu = (2 * fov * (u + ti.random(ti.f32)) / self.image_res[1] -
+        fu = (2 * fov * u / self.image_res[1] -
               fov * self.aspect_ratio - 1e-5)
-        fv = 2 * fov * (v + ti.random(ti.f32)) / self.image_res[1] - fov - 1e-5
+        fv = 2 * fov * v / self.image_res[1] - fov - 1e-5
         du = d.cross(self.up[None]).normalized()
         dv = du.cross(d).normalized()
         d = (d + fu * du + fv * dv).normalized()
         return d
 
+    @ti.kernel
+    def depth_prepass(self):
+        '''
+        Cone marches one cone per prepass_tile x prepass_tile pixels tile,
+        enclosing all of its primary rays, and stores in _prepass_dist the
+        distance they can all skip before sphere tracing.
+        '''
+        T = ti.static(self.prepass_tile)
+        #half angle of the tile seen from the camera (upper bound)
+        tan_a = 2**0.5 * self.fov[None] * T / self.image_res[1]
+        for i, j in self._prepass_dist:
+            d = self.get_pixel_dir((i + 0.5) * T, (j + 0.5) * T)
+            p = self.camera_pos[None]
+            dist = 0.0
+            k = 0
+            while k < self.ray_march_sdf_steps and dist < DIS_LIMIT:
+                #largest step keeping the cone in the empty sphere
+                step = (self.cached_sdf(p + dist * d)[0] - dist * tan_a) / \
+                    (1 + tan_a)
+                if step <= 1e-4 * dist:
+                    break
+                dist += step
+                k += 1
+            self._prepass_dist[i, j] = ti.min(dist, DIS_LIMIT)
+
+    @ti.func
+    def get_prepass_dist(self, u, v):
+        '''
+        Distance all the primary rays of the pixel u, v of the (scaled)
+        color_buffer can skip, according to the depth prepass
+        '''
+        k = self._scale[None]
+        T = ti.static(self.prepass_tile)
+        i0, i1 = u * k // T, ((u + 1) * k - 1) // T
+        j0, j1 = v * k // T, ((v + 1) * k - 1) // T
+        return ti.min(self._prepass_dist[i0, j0], self._prepass_dist[i1, j0],
+                      self._prepass_dist[i0, j1], self._prepass_dist[i1, j1])
+
     @ti.kernel
     def render(self):
         ti.loop_config(block_dim=256)
-        for u, v in self.color_buffer:
-            d = self.get_cast_dir(u, v)
+        k = self._scale[None]
+        x0, y0, x1, y1 = self._window[None]
+        for u, v in ti.ndrange((x0, ti.min(x1, -(-self.image_res[0] // k))),
+                               (y0, ti.min(y1, -(-self.image_res[1] // k)))):
+            if ti.static(self.adaptive_threshold > 0):
+                if not self._tile_active[u // self.adaptive_tile,
+                                         v // self.adaptive_tile]:
+                    continue
+            rng = self.start_sampling(u, v)
+            d, rng = self.get_cast_dir(u, v, rng)
+            if ti.static(self.collect_stats):
+                self.stats.record_path(u, v)
             pos = self.camera_pos[None]
             t = 0.0
+            if ti.static(self.prepass_tile > 0):
+                t = self.get_prepass_dist(u, v)
 
             contrib = ti.Vector([0.0, 0.0, 0.0])
             throughput = ti.Vector([1.0, 1.0, 1.0])
@@ -192,30 +693,43 @@ class Renderer:
             # Tracing begin
             for bounce in range(MAX_RAY_DEPTH):
                 depth += 1
-                closest, normal, c, hit_light = self.next_hit(pos, d, t)
+                closest, normal, c, hit_light, cost = self.next_hit(pos, d, t)
+                if ti.static(self.collect_stats):
+                    self.stats.record_ray(u, v, cost, 1)
+                if ti.static(self.temporal_max_history > 0):
+                    if bounce == 0:
+                        self._hit_pos[u, v] = pos + ti.min(closest,
+                                                           DIS_LIMIT) * d
+                if ti.static(self.use_denoiser):
+                    if bounce == 0:
+                        if normal.norm() != 0 and closest < 1e8:
+                            self.denoiser.record(u, v, normal, c, closest)
+                        else:
+                            self.denoiser.record(
+                                u, v, -d, self.background_color[None],
+                                DIS_LIMIT)
+                t = 0.0
                 hit_pos = pos + closest * d
                 if not hit_light and normal.norm() != 0 and closest < 1e8:
-                    d = out_dir(normal)
+                    r1, rng = self.next_random(rng)
+                    r2, rng = self.next_random(rng)
+                    d = cosine_dir(normal, r1, r2)
                     pos = hit_pos + 1e-4 * d
                     throughput *= c
 
                     if ti.static(use_directional_light):
-                        dir_noise = ti.Vector([
-                            ti.random() - 0.5,
-                            ti.random() - 0.5,
-                            ti.random() - 0.5
-                        ]) * self.light_direction_noise[None]
-                        light_dir = (self.light_direction[None] +
-                                     dir_noise).normalized()
+                        r1, rng = self.next_random(rng)
+                        r2, rng = self.next_random(rng)
+                        r3, rng = self.next_random(rng)
+                        light_dir = self.get_light_dir(r1, r2, r3)
                         dot = light_dir.dot(normal)
                         if dot > 0:
-                            hit_light_ = 0
-                            dist, _, _, hit_light_ = self.next_hit(
-                                pos, light_dir, t)
-                            if dist > DIS_LIMIT:
-                                # far enough to hit directional light
-                                contrib += throughput * \
-                                    self.light_color[None] * dot
+                            visibility, cost = self.light_visibility(
+                                pos, light_dir)
+                            contrib += throughput * self.light_color[None] * \
+                                dot * visibility
+                            if ti.static(self.collect_stats):
+                                self.stats.record_ray(u, v, cost, 0)
                 else:  # hit background or light voxel, terminate tracing
                     hit_background = 1
                     #Kn: Add light from "Sky"
@@ -224,7 +738,8 @@ class Renderer:
 
                 # Russian roulette
                 max_c = throughput.max()
-                if ti.random() > max_c:
+                r, rng = self.next_random(rng)
+                if r > max_c:
                     throughput = [0, 0, 0]
                     break
                 else:
@@ -242,11 +757,232 @@ class Renderer:
             #Kn: "Ambient" light
             contrib += throughput * self.ambient_color[None]
     
-            self.color_buffer[u, v] += contrib
+            self.add_sample(u, v, contrib)
+
+    @ti.func
+    def add_sample(self, u, v, contrib):
+        self.color_buffer[u, v] += contrib
+        if ti.static(self.adaptive_threshold > 0):
+            lum = contrib.dot(ti.Vector([0.2126, 0.7152, 0.0722]))
+            self._lum_sq_buffer[u, v] += lum * lum
+        if ti.static(self.use_sample_count):
+            self._sample_count[u, v] += 1
+
+    @ti.kernel
+    def _update_convergence(self) -> ti.i32:
+        '''
+        Retires the tiles whose pixels all have a relative standard error
+        (of their mean luminance, with a 0.1 floor) below
+        adaptive_threshold. Returns the number of pixels still sampled.
+        '''
+        for I in ti.grouped(self._tile_error):
+            self._tile_error[I] = 0.
+        for u, v in self.color_buffer:
+            T = ti.static(self.adaptive_tile)
+            if self._tile_active[u // T, v // T]:
+                n = ti.cast(self._sample_count[u, v], ti.f32)
+                err = inf
+                if n >= self.adaptive_min_spp:
+                    mean = self.color_buffer[u, v].dot(
+                        ti.Vector([0.2126, 0.7152, 0.0722])) / n
+                    var = ti.max(self._lum_sq_buffer[u, v] / n - mean * mean,
+                                 0.) * n / (n - 1)
+                    err = ti.sqrt(var / n) / (mean + 0.1)
+                ti.atomic_max(self._tile_error[u // T, v // T], err)
+        active = 0
+        for i, j in self._tile_error:
+            if self._tile_active[i, j]:
+                if self._tile_error[i, j] < self.adaptive_threshold:
+                    self._tile_active[i, j] = 0
+                else:
+                    T = ti.static(self.adaptive_tile)
+                    active += (ti.min(T, self.image_res[0] - i * T) *
+                               ti.min(T, self.image_res[1] - j * T))
+        return active
+
+    @property
+    def converged(self):
+        return self.coverage == 0
+
+    def _allocate_adaptive_buffers(self):
+        tiles = (-(-self.image_res[0] // self.adaptive_tile),
+                 -(-self.image_res[1] // self.adaptive_tile))
+        self._lum_sq_buffer = ti.field(dtype=ti.f32, shape=self.image_res)
+        self._tile_active = ti.field(dtype=ti.i32, shape=tiles)
+        self._tile_error = ti.field(dtype=ti.f32, shape=tiles)
+        self._tile_active.fill(1)
+
+    def _allocate_temporal_buffers(self):
+        self._hit_pos = ti.Vector.field(3, dtype=ti.f32, shape=self.image_res)
+        self._history_color = ti.Vector.field(3, dtype=ti.f32,
+                                              shape=self.image_res)
+        self._history_pos = ti.Vector.field(3, dtype=ti.f32,
+                                            shape=self.image_res)
+        self._history_count = ti.field(dtype=ti.i32, shape=self.image_res)
+        if self.adaptive_threshold > 0:
+            self._history_lum_sq = ti.field(dtype=ti.f32,
+                                            shape=self.image_res)
+        #view the framebuffer was rendered from
+        self._view_camera_pos = ti.Vector.field(3, dtype=ti.f32, shape=())
+        self._view_look_at = ti.Vector.field(3, dtype=ti.f32, shape=())
+        self._view_up = ti.Vector.field(3, dtype=ti.f32, shape=())
+        self._view_fov = ti.field(dtype=ti.f32, shape=())
+        self._save_view()
+
+    @ti.kernel
+    def _save_view(self):
+        self._view_camera_pos[None] = self.camera_pos[None]
+        self._view_look_at[None] = self.look_at[None]
+        self._view_up[None] = self.up[None]
+        self._view_fov[None] = self.fov[None]
+
+    @ti.func
+    def project_to_view(self, p):
+        '''
+        Pixel coordinates (of the scaled color_buffer) of p in the view the
+        framebuffer was rendered from, and whether it is in front of it.
+        Inverse of get_pixel_dir().
+        '''
+        d = (self._view_look_at[None] - self._view_camera_pos[None]).normalized()
+        du = d.cross(self._view_up[None]).normalized()
+        dv = du.cross(d).normalized()
+        q = p - self._view_camera_pos[None]
+        z = q.dot(d)
+        fov = self._view_fov[None]
+        k = self._scale[None]
+        x = ((q.dot(du) / z + fov * self.aspect_ratio + 1e-5) *
+             self.image_res[1] / (2 * fov) / k)
+        y = (q.dot(dv) / z + fov + 1e-5) * self.image_res[1] / (2 * fov) / k
+        return ti.Vector([x, y]), z > 0
+
+    @ti.kernel
+    def _reproject(self):
+        k = self._scale[None]
+        w = -(-self.image_res[0] // k)
+        h = -(-self.image_res[1] // k)
+        for u, v in ti.ndrange(w, h):
+            d = self.get_pixel_dir((u + 0.5) * k, (v + 0.5) * k)
+            pos = self.camera_pos[None]
+            t = 0.0
+            if ti.static(self.prepass_tile > 0):
+                t = self.get_prepass_dist(u, v)
+            closest, normal, c, _, _ = self.next_hit(pos, d, t)
+            hit = normal.norm() != 0 and closest < DIS_LIMIT
+            p = pos + ti.min(closest, DIS_LIMIT) * d
+            self._hit_pos[u, v] = p
+
+            n = 0
+            xy, in_front = self.project_to_view(p)
+            if in_front and xy[0] >= 0 and xy[0] < w and xy[1] >= 0 and \
+                    xy[1] < h:
+                x = ti.cast(xy[0], ti.i32)
+                y = ti.cast(xy[1], ti.i32)
+                n_old = self._history_count[x, y]
+                #disocclusions and depth mismatches don't reuse samples
+                if n_old > 0 and (self._history_pos[x, y] - p).norm() <= \
+                        self.temporal_tolerance * (p - pos).norm():
+                    n = ti.min(n_old, self.temporal_max_history)
+                    self.color_buffer[u, v] = \
+                        self._history_color[x, y] * n / n_old
+                    if ti.static(self.adaptive_threshold > 0):
+                        self._lum_sq_buffer[u, v] = \
+                            self._history_lum_sq[x, y] * n / n_old
+            if n == 0:
+                self.color_buffer[u, v] = ti.Vector([0.0, 0.0, 0.0])
+                if ti.static(self.adaptive_threshold > 0):
+                    self._lum_sq_buffer[u, v] = 0.
+            self._sample_count[u, v] = n
+            if ti.static(self.use_denoiser):
+                if hit:
+                    self.denoiser.store(u, v, normal, c, closest, n)
+                else:
+                    self.denoiser.store(u, v, -d, self.background_color[None],
+                                        DIS_LIMIT, n)
+
+    def reproject_framebuffer(self):
+        '''
+        To be called instead of reset_framebuffer() after a camera move when
+        temporal_max_history > 0: keeps (up to temporal_max_history of) the
+        samples of the pixels still visible from the new view.
+        '''
+        if self.temporal_max_history <= 0 or self._hit_pos is None:
+            self.reset_framebuffer()
+            return
+        self._prepare()
+        self._history_color.copy_from(self.color_buffer)
+        self._history_pos.copy_from(self._hit_pos)
+        self._history_count.copy_from(self._sample_count)
+        if self.adaptive_threshold > 0:
+            self._history_lum_sq.copy_from(self._lum_sq_buffer)
+            self._tile_active.fill(1)
+        self._reproject()
+        self._save_view()
+        if self.stats is not None:
+            self.stats.reset()
+        #the kept samples used the indices of the previous view, the next
+        #ones must not repeat them
+        self.sample_offset += self.current_spp
+        self.current_spp = 0
+        self.coverage = 1.
+
+    @ti.func
+    def get_pixel_samples(self, i, j, samples):
+        '''
+        Number of samples in the pixel i, j of color_buffer
+        '''
+        n = samples
+        if ti.static(self.use_sample_count):
+            n = ti.max(self._sample_count[i, j], 1)
+        return n
+
+    @ti.func
+    def get_pixel_color(self, i, j, samples):
+        '''
+        Average color of the pixel i, j of color_buffer (denoised when the
+        denoiser ran)
+        '''
+        c = ti.Vector([0.0, 0.0, 0.0])
+        if ti.static(self.use_denoiser):
+            if self.denoiser.active[None]:
+                c = self.denoiser.output[i, j]
+            else:
+                c = self.color_buffer[i, j] / self.get_pixel_samples(
+                    i, j, samples)
+        else:
+            c = self.color_buffer[i, j] / self.get_pixel_samples(
+                i, j, samples)
+        return c
+
+    @ti.func
+    def get_upsampled_color(self, i, j, samples):
+        '''
+        Bilinear interpolation of the scaled color_buffer at the image
+        pixel i, j
+        '''
+        k = self._scale[None]
+        c = ti.Vector([0.0, 0.0, 0.0])
+        if k == 1:
+            c = self.get_pixel_color(i, j, samples)
+        else:
+            w = -(-self.image_res[0] // k)
+            h = -(-self.image_res[1] // k)
+            x = ti.math.clamp((i + 0.5) / k - 0.5, 0., w - 1.)
+            y = ti.math.clamp((j + 0.5) / k - 0.5, 0., h - 1.)
+            x0 = ti.cast(x, ti.i32)
+            y0 = ti.cast(y, ti.i32)
+            x1 = ti.min(x0 + 1, w - 1)
+            y1 = ti.min(y0 + 1, h - 1)
+            fx = x - x0
+            fy = y - y0
+            c = ((1 - fx) * (1 - fy) * self.get_pixel_color(x0, y0, samples) +
+                 fx * (1 - fy) * self.get_pixel_color(x1, y0, samples) +
+                 (1 - fx) * fy * self.get_pixel_color(x0, y1, samples) +
+                 fx * fy * self.get_pixel_color(x1, y1, samples))
+        return c
 
     @ti.kernel
     def _render_to_image(self, samples: ti.i32):
-        for i, j in self.color_buffer:
+        for i, j in self._rendered_image:
             u = 1.0 * i / self.image_res[0]
             v = 1.0 * j / self.image_res[1]
 
@@ -254,23 +990,112 @@ class Renderer:
                 (u - self.vignette_center[0])**2 +
                 (v - self.vignette_center[1])**2) - self.vignette_radius), 0)
 
+            color = self.get_upsampled_color(i, j, samples)
             for c in ti.static(range(3)):
                 self._rendered_image[i, j][c] = ti.sqrt(
-                    self.color_buffer[i, j][c] * darken * self.exposure /
-                    samples)
+                    color[c] * darken * self.exposure)
+
+    @ti.kernel
+    def _average_to_image(self, samples: ti.i32):
+        for i, j in self._rendered_image:
+            self._rendered_image[i, j] = self.get_upsampled_color(i, j,
+                                                                  samples)
+
+    def set_resolution_scale(self, scale):
+        '''
+        Renders at image_res / scale (an integer) from now on, without
+        compiling the kernels again. Resets the framebuffer.
+        '''
+        self.resolution_scale = scale
+        self._scale[None] = scale
+        self.reset_framebuffer()
+
+    def set_window(self, x0, y0, x1, y1):
+        '''
+        Only the pixels x0 <= x < x1, y0 <= y < y1 (of the scaled
+        color_buffer) get samples, e.g. to split an image in tiles.
+        '''
+        self._window[None] = (x0, y0, x1, y1)
 
     def reset_framebuffer(self):
         self.current_spp = 0
+        self.framebuffer_dirty = False
         self.color_buffer.fill(0)
+        self.coverage = 1.
+        if self.denoiser is not None:
+            self.denoiser.reset()
+        if self._sample_count is not None:
+            self._sample_count.fill(0)
+        if self._lum_sq_buffer is not None:
+            self._lum_sq_buffer.fill(0)
+            self._tile_active.fill(1)
+        if self._hit_pos is not None:
+            self._save_view()
+        if self.stats is not None:
+            self.stats.reset()
+
+    def _prepare(self):
+        '''
+        Builds what the kernels need before rendering: caches, prepass and
+        the buffers of the enabled features.
+        '''
+        if self.sdf_cache is not None and self.sdf_cache.dirty:
+            self.sdf_cache.build(self.sdf)
+            self._prepass_dirty = True
+        if self.prepass_tile > 0 and self._prepass_dirty:
+            if self._prepass_dist is None:
+                self._prepass_dist = ti.field(dtype=ti.f32, shape=(
+                    -(-self.image_res[0] // self.prepass_tile),
+                    -(-self.image_res[1] // self.prepass_tile)))
+            self.depth_prepass()
+            self._prepass_dirty = False
+        if self.use_sample_count and self._sample_count is None:
+            self._sample_count = ti.field(dtype=ti.i32, shape=self.image_res)
+        if self.adaptive_threshold > 0 and self._lum_sq_buffer is None:
+            self._allocate_adaptive_buffers()
+        if self.temporal_max_history > 0 and self._hit_pos is None:
+            self._allocate_temporal_buffers()
+        if self.denoiser_settings is not None and self.denoiser is None:
+            self.denoiser = Denoiser(self.image_res, **self.denoiser_settings)
+        if self.collect_stats and self.stats is None:
+            self.stats = RenderStats(self.image_res)
+        if self.pipeline == 'wavefront' and self.wavefront is None:
+            self.wavefront = Wavefront(self.image_res, MAX_RAY_DEPTH,
+                                       DIS_LIMIT, use_directional_light)
 
     def accumulate(self):
-        self.render()
+        if self.framebuffer_dirty:
+            self.reset_framebuffer()
+        self._prepare()
+        self._sample_index[None] = self.sample_offset + self.current_spp
+        if self.pipeline == 'wavefront':
+            self.wavefront.render(self)
+        else:
+            self.render()
         self.current_spp += 1
+        if (self.adaptive_threshold > 0 and self.resolution_scale == 1 and
+                self.current_spp >= self.adaptive_min_spp):
+            self.coverage = self._update_convergence() / (
+                self.image_res[0] * self.image_res[1])
 
     def fetch_image(self):
+        if self.display != 'color' and self.stats is not None:
+            return self.stats.heatmap(self, self.display)
+        if self.denoiser is not None:
+            self.denoiser.filter(self, self.current_spp)
         self._render_to_image(self.current_spp)
         return self._rendered_image
 
+    def fetch_average(self):
+        '''
+        Average (linear) color of the pixels, denoised when the denoiser is
+        enabled, without vignetting nor tonemapping
+        '''
+        if self.denoiser is not None:
+            self.denoiser.filter(self, self.current_spp)
+        self._average_to_image(self.current_spp)
+        return self._rendered_image
+
     @staticmethod
     @ti.func
     def to_vec3u(c):
@@ -288,3 +1113,8 @@ class Renderer:
             r[i] = ti.cast(c[i], ti.f32) / 255.0
         return r
 
+
+def _parameter_array(value):
+    if hasattr(value, 'to_numpy'):
+        value = value.to_numpy()
+    return np.asarray(value)
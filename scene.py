@@ -1,15 +1,28 @@
 from ast import Not
+import argparse
+import contextlib
+import json
+import runpy
+import sys
 import time
 import os
 from datetime import datetime
 import numpy as np
 import taichi as ti
-from renderer import Renderer
-from math_utils import np_normalize, np_rotate_matrix
+from renderer import Renderer, NORMAL_STRATEGIES, PIPELINES, SAMPLERS
+from sdf_cache import SDFCache
+from animation import CameraPath, render_sequence
+from checkpoint import Checkpoint
+from profiler import FrameProfiler
+from sdf_query import SDFQuery
+from stats import HEATMAPS
+from math_utils import inf, np_normalize, np_rotate_matrix
 
 VOXEL_DX = 1 / 64
 SCREEN_RES = (1280, 720)
 TARGET_FPS = 30
+#the resolution is divided by up to this while the camera moves
+MAX_RESOLUTION_SCALE = 4
 UP_DIR = (0, 1, 0)
 HELP_MSG = '''
 ====================================================
@@ -19,6 +32,112 @@ Camera:
 ====================================================
 '''
 
+ARCHS = ('cpu', 'vulkan', 'cuda', 'gpu', 'opengl', 'metal')
+
+#Options that are not given to Scene() come from here then from the command line
+_overrides = {}
+
+
+def configure(**kwargs):
+    '''
+    Override scene options (same names as the command line ones: headless,
+    arch, threads, res, spp, time_budget, output, camera_path, workers,
+    checkpoint, checkpoint_interval, pipeline, sampler, stats, heatmap,
+    profile, offline_cache) for the next Scene(). finish=False makes
+    Scene.finish() return immediately.
+    Useful to run the example scripts from another python program.
+    '''
+    _overrides.update(kwargs)
+
+
+def parse_options(argv=None):
+    '''
+    Reads the scene options from the command line. Unknown arguments are
+    ignored so that the example scripts can have their own.
+    '''
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--headless', action='store_true',
+                        help='render without window and write the image to disk')
+    parser.add_argument('--arch', choices=ARCHS, default=None,
+                        help='taichi backend (default: vulkan, cpu when headless)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='max number of threads of the cpu backend')
+    parser.add_argument('--res', type=_parse_res, default=None,
+                        help='image resolution as WIDTHxHEIGHT')
+    parser.add_argument('--spp', type=int, default=None,
+                        help='headless: number of samples per pixel (default: maxSamples)')
+    parser.add_argument('--time-budget', dest='time_budget', type=float,
+                        default=None,
+                        help='headless: stop after this many seconds')
+    parser.add_argument('--output', default=None,
+                        help='headless: image file to write')
+    parser.add_argument('--camera-path', dest='camera_path', default=None,
+                        help='headless: render the frames of this camera '
+                        'path (JSON keyframes, see animation.py)')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='headless: threads encoding the frames')
+    parser.add_argument('--checkpoint', default=None,
+                        help='headless: .npy file the accumulation is saved '
+                        'to and resumed from, see checkpoint.py')
+    parser.add_argument('--checkpoint-interval', dest='checkpoint_interval',
+                        type=float, default=300,
+                        help='headless: seconds between checkpoints')
+    parser.add_argument('--pipeline', choices=PIPELINES, default=None,
+                        help='megakernel (default) or wavefront rendering')
+    parser.add_argument('--sampler', choices=SAMPLERS, default=None,
+                        help='random numbers: random (default), hash or '
+                        'sobol (low-discrepancy)')
+    parser.add_argument('--stats', action='store_true',
+                        help='count the march steps and sdf evaluations of '
+                        'each pixel, headless: print their statistics')
+    parser.add_argument('--heatmap', choices=HEATMAPS, default=None,
+                        help='show this cost per sample instead of the '
+                        'color (implies --stats)')
+    parser.add_argument('--profile', default=None,
+                        help='time the phases and kernels of each frame and '
+                        'write them to this Chrome trace JSON file, see '
+                        'profiler.py')
+    parser.add_argument('--no-offline-cache', dest='offline_cache',
+                        action='store_false',
+                        help='always recompile the kernels')
+    options, _ = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    options.finish = True
+    for k, v in _overrides.items():
+        setattr(options, k, v)
+    if options.arch is None:
+        options.arch = 'cpu' if options.headless else 'vulkan'
+    if options.res is None:
+        options.res = SCREEN_RES
+    return options
+
+
+def load_scene(path, **options):
+    '''
+    Runs a scene script (example.py, mosley.py...) headless without
+    rendering it and returns its Scene, e.g. for benchmarking.
+    options are the same as for configure().
+    '''
+    saved_overrides = dict(_overrides)
+    saved_argv = sys.argv
+    configure(headless=True, finish=False, **options)
+    sys.argv = [path]
+    try:
+        script_globals = runpy.run_path(path, run_name='__scene__')
+    finally:
+        sys.argv = saved_argv
+        _overrides.clear()
+        _overrides.update(saved_overrides)
+    for v in script_globals.values():
+        if isinstance(v, Scene):
+            return v
+    raise ValueError(f"{path} does not create a Scene")
+
+
+def _parse_res(s):
+    w, h = s.lower().split('x')
+    return (int(w), int(h))
+
+
 def defGUI(win):
     return
 
@@ -113,19 +232,48 @@ class Camera:
 
 
 class Scene:
-    def __init__(self, exposure=3):
-        ti.init(arch=ti.vulkan)
-        print(HELP_MSG)
-        self.window = ti.ui.Window("Taichi SDF Renderer",
-                                   SCREEN_RES,
-                                   vsync=True)
+    def __init__(self, exposure=3, **options):
+        '''
+        options override the command line ones, see parse_options()
+        '''
+        self.options = parse_options()
+        for k, v in options.items():
+            setattr(self.options, k, v)
+        self.headless = self.options.headless
+        init_kwargs = {'offline_cache': self.options.offline_cache}
+        if self.options.threads is not None:
+            init_kwargs['cpu_max_num_threads'] = self.options.threads
+        if self.options.profile is not None:
+            init_kwargs['kernel_profiler'] = True
+        ti.init(arch=getattr(ti, self.options.arch), **init_kwargs)
+        self.profiler = None
+        if self.options.profile is not None:
+            #the kernel profiler only works on the cpu and cuda backends
+            self.profiler = FrameProfiler(
+                kernels=ti.cfg.arch in (ti.x64, ti.arm64, ti.cuda))
+        self.window = None
+        if not self.headless:
+            print(HELP_MSG)
+            self.window = ti.ui.Window("Taichi SDF Renderer",
+                                       self.options.res,
+                                       vsync=True)
         self.camera = Camera(self.window, up=UP_DIR)
-        self.renderer = Renderer(image_res=SCREEN_RES,
+        self.renderer = Renderer(image_res=self.options.res,
                                  up=UP_DIR,
                                  exposure=exposure)
         self.renderer.set_camera_pos(*self.camera.position)
+        if self.options.pipeline is not None:
+            self.set_pipeline(self.options.pipeline)
+        if self.options.sampler is not None:
+            self.set_sampler(self.options.sampler)
+        if self.options.stats or self.options.heatmap is not None:
+            self.set_stats()
+        if self.options.heatmap is not None:
+            self.set_display(self.options.heatmap)
         self.maxSamples = 100
         self.GUICB = defGUI
+        self.dynamic_resolution = True
+        self._sdf_query = None
 
     def setGUICB(self, cb):
         self.GUICB = cb
@@ -145,6 +293,25 @@ class Scene:
         '''
         self.renderer.sdf = Nsdf
     
+    def set_sdf_graph(self, graph):
+        '''
+        Set the geometry as a scene graph (see sdf_graph.py), compiled to one
+        sdf. Its bounding box, if any, becomes a bounding volume.
+        '''
+        self.renderer.sdf = graph.compile()
+        bounds = graph.bounds()
+        if bounds is not None:
+            self.add_bounding_box(*bounds)
+
+    def evaluate_sdf(self, points, normals=False, colors=False):
+        '''
+        The sdf at the (N, 3) array points, and optionally the normals
+        (True or 'autodiff') and colors there, see SDFQuery.evaluate()
+        '''
+        if self._sdf_query is None:
+            self._sdf_query = SDFQuery(self.renderer)
+        return self._sdf_query.evaluate(points, normals, colors)
+
     def set_sdf_col(self, Nsdf):
         '''
         Set the function that gives the 
@@ -152,6 +319,211 @@ class Scene:
         '''
         self.renderer.sdf_color = Nsdf
 
+    def add_parameter(self, name, value):
+        '''
+        Registers a scalar, vector or matrix the sdf can read as
+        field[None] (returns the field). Change it with set_parameter(),
+        e.g. from the GUI callback: no recompilation, the image restarts.
+        '''
+        return self.renderer.add_parameter(name, value)
+
+    def set_parameter(self, name, value):
+        return self.renderer.set_parameter(name, value)
+
+    def get_parameter(self, name):
+        return self.renderer.get_parameter(name)
+
+    def set_ray_march(self, steps=None, relaxation=None):
+        '''
+        Max number of sphere tracing steps and over-relaxation factor
+        (1: plain sphere tracing, ~1.2-1.8: fewer steps on most scenes).
+        Must be called before rendering starts.
+        '''
+        if steps is not None:
+            self.renderer.ray_march_sdf_steps = steps
+        if relaxation is not None:
+            self.renderer.ray_march_relaxation = relaxation
+
+    def set_normal_strategy(self, strategy, epsilon=None):
+        '''
+        How the sdf normals are estimated: 'forward' (cheapest),
+        'central' or 'tetrahedral' (more accurate), see
+        Renderer.get_sdf_normal(). epsilon is the finite differences step
+        at distance 1 from the ray origin.
+        Must be called before rendering starts.
+        '''
+        if strategy not in NORMAL_STRATEGIES:
+            raise ValueError(f"Unknown normal strategy {strategy!r}, "
+                             f"expected one of {NORMAL_STRATEGIES}")
+        self.renderer.normal_strategy = strategy
+        if epsilon is not None:
+            self.renderer.normal_epsilon = epsilon
+
+    def add_plane(self, normal, offset, color):
+        '''
+        Analytic wall: the half space normal . p <= offset, intersected
+        before the sdf is marched (like the floor), much cheaper than the
+        same plane in the sdf. Must be called before rendering starts.
+        '''
+        normal = np.array(normal, np.float64)
+        norm = np.linalg.norm(normal)
+        self.renderer.planes.append((tuple((normal / norm).tolist()),
+                                     float(offset / norm), tuple(color)))
+
+    def add_bounding_box(self, box_min, box_max):
+        '''
+        Declares that (part of) the sdf surface lies inside this box.
+        When bounding volumes are given, rays are only marched inside
+        them: everything outside is skipped, so they must contain all of
+        the surface. Must be called before rendering starts.
+        '''
+        self.renderer.bounding_volumes.append(
+            ('box', tuple(box_min), tuple(box_max)))
+
+    def add_bounding_sphere(self, center, radius):
+        '''
+        Same as add_bounding_box() with a sphere
+        '''
+        self.renderer.bounding_volumes.append(
+            ('sphere', tuple(center), float(radius)))
+
+    def set_sdf_cache(self, box_min=None, box_max=None, bricks=32,
+                      brick_size=8):
+        '''
+        Caches lower bounds of the sdf in a sparse grid over the box
+        (by default the one around the bounding volumes) so that rays far
+        from the surface skip most sdf evaluations, see SDFCache.
+        The memory used is about 4 * (bricks^3 + refined bricks *
+        brick_size^3) bytes, and is printed when the cache is built.
+        Must be called before rendering starts.
+        '''
+        if box_min is None or box_max is None:
+            box_min, box_max = self._bounding_box()
+        self.renderer.sdf_cache = SDFCache(box_min, box_max, bricks,
+                                           brick_size)
+
+    def _bounding_box(self):
+        volumes = self.renderer.bounding_volumes
+        if not volumes:
+            raise ValueError("No box given nor bounding volume declared")
+        box_min = [inf] * 3
+        box_max = [-inf] * 3
+        for kind, a, b in volumes:
+            for i in range(3):
+                lo, hi = (a[i], b[i]) if kind == 'box' else (a[i] - b, a[i] + b)
+                box_min[i] = min(box_min[i], lo)
+                box_max[i] = max(box_max[i], hi)
+        return box_min, box_max
+
+    def set_depth_prepass(self, tile=8):
+        '''
+        Before rendering, cone marches one cone per tile x tile pixels to
+        find how far all the primary rays of the tile can start (computed
+        again only when the camera moves). 0 disables it.
+        Must be called before rendering starts.
+        '''
+        self.renderer.prepass_tile = tile
+
+    def set_adaptive_sampling(self, threshold=0.02, tile=16, min_spp=16):
+        '''
+        Stops sampling the tile x tile pixels tiles whose relative noise
+        is below threshold (after at least min_spp samples), so that the
+        samples go where the image is still noisy. Rendering stops when all
+        the tiles have converged. 0 disables it.
+        renderer.coverage is the fraction of the pixels still sampled.
+        Must be called before rendering starts.
+        '''
+        self.renderer.adaptive_threshold = threshold
+        self.renderer.adaptive_tile = tile
+        self.renderer.adaptive_min_spp = min_spp
+
+    def set_denoiser(self, iterations=5, **sigmas):
+        '''
+        Denoises the displayed image with an edge-avoiding a-trous filter
+        guided by the first hit normals, depths and albedos, so that
+        previews look clean at low spp. Once rendering started,
+        renderer.denoiser.enabled toggles it and
+        renderer.denoiser.last_time is its last run time.
+        sigmas: sigma_color, sigma_normal, sigma_depth, sigma_albedo
+        (see Denoiser). Must be called before rendering starts.
+        '''
+        self.renderer.denoiser_settings = dict(iterations=iterations,
+                                               **sigmas)
+
+    def set_temporal_reprojection(self, max_history=16, tolerance=0.02):
+        '''
+        When the camera moves, keeps the samples of the pixels that stay
+        visible (up to max_history per pixel) instead of starting over.
+        Pixels whose surface moved by more than tolerance times their
+        distance to the camera (disocclusions) are sampled again from 0.
+        0 disables it. Must be called before rendering starts.
+        '''
+        self.renderer.temporal_max_history = max_history
+        self.renderer.temporal_tolerance = tolerance
+
+    def set_sampler(self, sampler, seed=0):
+        '''
+        Random numbers used by the renderer: 'random' (ti.random()),
+        'hash', which makes renders reproducible (they only depend on
+        seed, the pixels and the sample indices) or 'sobol', reproducible
+        too and low-discrepancy: the same noise in fewer samples.
+        Must be called before rendering starts.
+        '''
+        if sampler not in SAMPLERS:
+            raise ValueError(f"Unknown sampler {sampler!r}, "
+                             f"expected one of {SAMPLERS}")
+        self.renderer.sampler = sampler
+        self.renderer.seed = seed
+
+    def set_soft_shadows(self, softness=16.):
+        '''
+        Noise-free penumbras estimated by each shadow ray (larger softness:
+        sharper shadows) instead of jittering the light direction,
+        0 to go back to the latter. Must be called before rendering starts.
+        '''
+        self.renderer.shadow_softness = softness
+
+    def set_pipeline(self, pipeline):
+        '''
+        'megakernel' (one kernel per sample) or 'wavefront' (a kernel per
+        stage on queues of the live paths, see wavefront.py)
+        '''
+        if pipeline not in PIPELINES:
+            raise ValueError(f"Unknown pipeline {pipeline!r}, "
+                             f"expected one of {PIPELINES}")
+        self.renderer.pipeline = pipeline
+
+    def set_stats(self, enabled=True):
+        '''
+        Per pixel counters of the march steps, sdf evaluations, march exits
+        and bounces (see stats.py), for stats_summary() and the heatmap
+        display. Compiled out when disabled. Must be called before rendering
+        starts.
+        '''
+        self.renderer.collect_stats = enabled
+
+    def stats_summary(self):
+        '''
+        Statistics of the samples rendered since the last reset, see
+        RenderStats.summary()
+        '''
+        if self.renderer.stats is None:
+            raise ValueError("No statistics, call set_stats() before "
+                             "rendering")
+        return self.renderer.stats.summary()
+
+    def set_display(self, display):
+        '''
+        'color', or one of the heatmaps of stats.HEATMAPS (cost per sample
+        of each pixel, needs set_stats())
+        '''
+        if display != 'color' and display not in HEATMAPS:
+            raise ValueError(f"Unknown display {display!r}, expected 'color' "
+                             f"or one of {HEATMAPS}")
+        if display != 'color' and not self.renderer.collect_stats:
+            raise ValueError("Heatmaps need set_stats()")
+        self.renderer.display = display
+
     def set_floor(self, height, color):
         self.renderer.floor_height[None] = height
         self.renderer.floor_color[None] = color
@@ -165,48 +537,212 @@ class Scene:
     def set_background_color(self, color):
         self.renderer.background_color[None] = color
 
+    def _phase(self, name):
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.phase(name)
+
+    def _frame(self):
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.frame_scope()
+
+    def _save_profile(self):
+        if self.profiler is None:
+            return
+        self.profiler.save(self.options.profile)
+        print(self.profiler.report())
+        print(f"Trace of {self.profiler.frame} frames saved to "
+              f"{self.options.profile}")
+
+    def render_headless(self, spp=None, time_budget=None, output=None):
+        '''
+        Accumulates spp samples per pixel and/or as many as fit in
+        time_budget seconds, then writes the image to output.
+        Returns the file name.
+        '''
+        if spp is None:
+            spp = self.options.spp
+        if time_budget is None:
+            time_budget = self.options.time_budget
+        if spp is None and time_budget is None:
+            spp = self.maxSamples
+        if output is None:
+            output = self.options.output
+        if output is None:
+            timestamp = datetime.today().strftime('%Y-%m-%d-%H%M%S')
+            output = os.path.join(os.getcwd(), f"render{timestamp}.png")
+
+        self.renderer.set_look_at(*self.camera.look_at)
+        self.renderer.reset_framebuffer()
+        checkpoint = None
+        if self.options.checkpoint is not None:
+            checkpoint = Checkpoint(self.options.checkpoint)
+            if checkpoint.load(self.renderer):
+                print(f"Resumed {self.renderer.current_spp} spp from "
+                      f"{checkpoint.path}")
+        t = time.time()
+        last_checkpoint = t
+        while spp is None or self.renderer.current_spp < spp:
+            with self._frame():
+                with self._phase('accumulate'):
+                    self.renderer.accumulate()
+                if self.renderer.converged:
+                    break
+                if checkpoint is not None and time.time() - \
+                        last_checkpoint >= self.options.checkpoint_interval:
+                    with self._phase('checkpoint'):
+                        checkpoint.save(self.renderer)
+                    last_checkpoint = time.time()
+            if time_budget is not None:
+                ti.sync()
+                if time.time() - t >= time_budget:
+                    break
+        if checkpoint is not None:
+            with self._phase('checkpoint'):
+                checkpoint.save(self.renderer)
+        with self._phase('fetch_image'):
+            img = self.renderer.fetch_image()
+        with self._phase('write'):
+            ti.tools.image.imwrite(img, output)
+        elapsed_time = time.time() - t
+        print(f"Rendered {self.renderer.current_spp} spp "
+              f"(coverage {self.renderer.coverage:.0%}) in "
+              f"{elapsed_time:.2f}s, saved to {output}")
+        if self.options.stats:
+            print(json.dumps(self.stats_summary(), indent=2))
+        self._save_profile()
+        return output
+
+    def _dynamic_resolution_scale(self, moving, sample_time):
+        '''
+        Lower resolution while the camera moves and a frame of 1 sample per
+        pixel doesn't fit in 1/TARGET_FPS, back to native resolution step by
+        step once it stops. sample_time: seconds per sample of the last
+        frame (0 when it rendered none), so that the spp adaptation doesn't
+        change the scale.
+        '''
+        scale = self.renderer.resolution_scale
+        if moving:
+            if sample_time * TARGET_FPS > 1 and scale < MAX_RESOLUTION_SCALE:
+                scale *= 2
+            elif 0 < sample_time * 4 * TARGET_FPS < 0.5 and scale > 1:
+                #4 times more pixels still fit in half of the frame: the
+                #margin keeps the scale from switching back and forth
+                scale //= 2
+        elif scale > 1:
+            scale //= 2
+        return scale
+
+    def render_animation(self, path=None, spp=None, output=None):
+        '''
+        Renders the frames of a camera path (CameraPath or JSON file name)
+        with spp samples each, see animation.py
+        '''
+        if path is None:
+            path = self.options.camera_path
+        if isinstance(path, str):
+            path = CameraPath.load(path, self.renderer.fov[None])
+        if spp is None:
+            spp = self.options.spp if self.options.spp is not None \
+                else self.maxSamples
+        if output is None:
+            output = self.options.output
+        if output is None:
+            output = os.path.join(os.getcwd(), "frame%04d.png")
+        return render_sequence(self.renderer, path, spp, output,
+                               workers=self.options.workers)
+
     def finish(self):
         '''
         Should be called at the end of your main file
         It runs the GUI and rendering
+        (or renders to disk without window when headless)
         '''
+        if not self.options.finish:
+            return
+        if self.headless:
+            if self.options.camera_path is not None:
+                self.render_animation()
+            else:
+                self.render_headless()
+            return
         canvas = self.window.get_canvas()
         nsamples = 0
         spp = 1
+        sample_time = 0
         ToggleGUI = False
-        SHIFTpressed = False
         while self.window.running:
-            SHIFTpressed = self.window.is_pressed(ti.ui.SHIFT) # ESCAPE)
-            #if self.window.is_pressed(ti.ui.ESCAPE): ToggleGUI = not(ToggleGUI)
-            #if self.window.get_event((ti.ui.PRESS, ti.ui.ESCAPE)) : ToggleGUI = not(ToggleGUI)
-            
-            should_reset_framebuffer = False
+            with self._frame():
+                spp, nsamples, sample_time = self._window_frame(
+                    canvas, spp, nsamples, sample_time)
+        self._save_profile()
 
+    def _window_frame(self, canvas, spp, nsamples, sample_time):
+        '''
+        One frame of the window loop of finish(), returns the spp of the
+        next one, the samples accumulated and the seconds per sample
+        '''
+        SHIFTpressed = self.window.is_pressed(ti.ui.SHIFT) # ESCAPE)
+        #if self.window.is_pressed(ti.ui.ESCAPE): ToggleGUI = not(ToggleGUI)
+        #if self.window.get_event((ti.ui.PRESS, ti.ui.ESCAPE)) : ToggleGUI = not(ToggleGUI)
+
+        should_reset_framebuffer = False
+        should_reproject_framebuffer = False
+
+        with self._phase('camera'):
             #if SHIFTpressed:
-            if self.camera.update_camera():
+            moving = self.camera.update_camera()
+            if moving:
                 self.renderer.set_camera_pos(*self.camera.position)
                 look_at = self.camera.look_at
                 self.renderer.set_look_at(*look_at)
-                should_reset_framebuffer = True
+                should_reproject_framebuffer = True
+
+            if self.dynamic_resolution:
+                scale = self._dynamic_resolution_scale(moving, sample_time)
+                if scale != self.renderer.resolution_scale:
+                    self.renderer.set_resolution_scale(scale)
+                    should_reset_framebuffer = True
 
-            #if not(SHIFTpressed) : self.GUICB(self.window)
+        #parameters changed by the callback reset the framebuffer
+        with self._phase('gui'):
+            self.GUICB(self.window)
+        if self.renderer.framebuffer_dirty:
+            should_reset_framebuffer = True
 
+        with self._phase('framebuffer'):
             if should_reset_framebuffer:
                 self.renderer.reset_framebuffer()
                 nsamples = 0
+            elif should_reproject_framebuffer:
+                self.renderer.reproject_framebuffer()
+                nsamples = 0
 
-            t = time.time()
-            if(nsamples < self.maxSamples):
+        t = time.time()
+        samples = 0
+        with self._phase('accumulate'):
+            if(nsamples < self.maxSamples and not self.renderer.converged):
                 for _ in range(spp):
                     self.renderer.accumulate()
-                    nsamples += 1
+                    samples += 1
+            nsamples += samples
+        if self.renderer.collect_stats and \
+                self.window.get_event(ti.ui.PRESS) and \
+                self.window.event.key == 'h':
+            displays = ('color',) + HEATMAPS
+            self.set_display(displays[(displays.index(
+                self.renderer.display) + 1) % len(displays)])
+        with self._phase('fetch_image'):
             img = self.renderer.fetch_image()
-            if self.window.is_pressed('p'):
+        if self.window.is_pressed('p'):
+            with self._phase('screenshot'):
                 timestamp = datetime.today().strftime('%Y-%m-%d-%H%M%S')
                 dirpath = os.getcwd()
                 fname = os.path.join(dirpath, f"screenshot{timestamp}.jpg")
                 ti.tools.image.imwrite(img, fname)
                 print(f"Screenshot has been saved to {fname}")
+        with self._phase('present'):
             canvas.set_image(img)
             elapsed_time = time.time() - t
             if(nsamples < self.maxSamples):
@@ -217,3 +753,4 @@ class Scene:
                     spp += 1
 
             self.window.show()
+        return spp, nsamples, elapsed_time / samples if samples else 0
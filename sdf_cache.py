@@ -0,0 +1,91 @@
+import taichi as ti
+
+from math_utils import inf
+
+
+@ti.data_oriented
+class SDFCache:
+    '''
+    Sparse grid of conservative lower bounds of the sdf inside a box, so that
+    the ray marcher can take large safe steps far from the surface without
+    evaluating the sdf.
+    The box is split in bricks x bricks x bricks bricks, each holding one
+    bound. Only the bricks whose bound is smaller than a cell (close to the
+    surface) get their brick_size^3 cells (ti.root.pointer), so the memory
+    grows with the surface.
+    Assumes the sdf is 1-Lipschitz (never overestimates distances).
+    '''
+    def __init__(self, box_min, box_max, bricks=32, brick_size=8):
+        self.box_min = ti.Vector(list(box_min), ti.f32)
+        self.bricks = bricks
+        self.brick_size = brick_size
+        self.cells = bricks * brick_size
+        extent = max(box_max[i] - box_min[i] for i in range(3))
+        self.cell_edge = extent / self.cells
+        self.brick_edge = self.cell_edge * brick_size
+        self.sdf = None
+        self.dirty = True
+
+        fb = ti.FieldsBuilder()
+        self.brick_bound = ti.field(dtype=ti.f32)
+        fb.dense(ti.ijk, bricks).place(self.brick_bound)
+        self.cell_bound = ti.field(dtype=ti.f32)
+        self._brick_ptr = fb.pointer(ti.ijk, bricks)
+        self._brick_ptr.dense(ti.ijk, brick_size).place(self.cell_bound)
+        self._snode_tree = fb.finalize()
+        self.active_bricks = ti.field(dtype=ti.i32, shape=())
+
+    def invalidate(self):
+        '''
+        The sdf changed: rebuild the cache before its next use
+        '''
+        self.dirty = True
+
+    @ti.kernel
+    def _build_bricks(self):
+        half_diag = 0.5 * 3**0.5 * self.brick_edge
+        for I in ti.grouped(self.brick_bound):
+            center = self.box_min + (I + 0.5) * self.brick_edge
+            self.brick_bound[I] = self.sdf(center) - half_diag
+
+    @ti.kernel
+    def _build_cells(self):
+        half_diag = 0.5 * 3**0.5 * self.cell_edge
+        self.active_bricks[None] = 0
+        for I in ti.grouped(ti.ndrange(self.cells, self.cells, self.cells)):
+            B = I // self.brick_size
+            if self.brick_bound[B] <= self.cell_edge:
+                center = self.box_min + (I + 0.5) * self.cell_edge
+                self.cell_bound[I] = self.sdf(center) - half_diag
+                if (I % self.brick_size == 0).all():
+                    self.active_bricks[None] += 1
+
+    def build(self, sdf):
+        self.sdf = sdf
+        self._brick_ptr.deactivate_all()
+        self._build_bricks()
+        self._build_cells()
+        self.dirty = False
+        print(f"SDF cache: {self.active_bricks[None]}/{self.bricks**3} "
+              f"bricks refined, {self.memory_bytes() / 2**20:.1f} MB")
+
+    def memory_bytes(self):
+        '''
+        Memory used by the bounds (pointer overhead excepted)
+        '''
+        return 4 * (self.bricks**3 +
+                    self.active_bricks[None] * self.brick_size**3)
+
+    @ti.func
+    def lower_bound(self, p):
+        '''
+        Lower bound of the sdf at p, -inf when p is outside of the cache
+        '''
+        bound = -inf
+        x = (p - self.box_min) / self.cell_edge
+        if (x >= 0).all() and (x < self.cells).all():
+            I = ti.cast(x, ti.i32)
+            bound = self.brick_bound[I // self.brick_size]
+            if bound <= self.cell_edge:
+                bound = self.cell_bound[I]
+        return bound
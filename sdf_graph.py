@@ -0,0 +1,466 @@
+'''
+Scene graph of SDF primitives, CSG operations, transforms and repetitions,
+compiled to a single Taichi function:
+
+    from sdf_graph import Box, Plane, Sphere
+    shape = (Sphere(0.36).translate((0, 0.35, 0)) | Box((0.3, 0.3, 0.3))) \
+        - Sphere(0.2).repeat((0.5, 0, 0), (2, 0, 0))
+    scene.set_sdf_graph(Plane((0, 1, 0), -0.1) | shape)
+
+Each node knows a box around its surface (None when unbounded). The
+generated code only evaluates the children of unions and subtractions whose
+box is close enough to change the result, so the sdf is the same as without
+the culling: a conservative bound of the distance (exact only for unions of
+exact primitives).
+'''
+import abc
+import numpy as np
+import taichi as ti
+
+from math_utils import aabb_distance, np_rotate_matrix
+
+
+def _union_bounds(a, b):
+    if a is None or b is None:
+        return None
+    return np.minimum(a[0], b[0]), np.maximum(a[1], b[1])
+
+
+def _intersection_bounds(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return np.maximum(a[0], b[0]), np.minimum(a[1], b[1])
+
+
+def _pad_bounds(bounds, padding):
+    if bounds is None:
+        return None
+    return bounds[0] - padding, bounds[1] + padding
+
+
+def _vec(v):
+    return [float(x) for x in v]
+
+
+class Node(abc.ABC):
+    def bounds(self):
+        '''
+        (min, max) of a box around the surface, None if unbounded. Outside of
+        it the sdf is at least the distance to the box.
+        '''
+        return None
+
+    @abc.abstractmethod
+    def build(self):
+        '''
+        Returns the ti.func of the sdf of the subtree
+        '''
+
+    def compile(self):
+        sdf = self.build()
+        sdf.sdf_graph = self
+        return sdf
+
+    def __repr__(self):
+        args = ', '.join(f"{k}={v!r}" for k, v in vars(self).items())
+        return f"{type(self).__name__}({args})"
+
+    def __or__(self, other):
+        return Union(self, other)
+
+    def __and__(self, other):
+        return Intersection(self, other)
+
+    def __sub__(self, other):
+        return Subtraction(self, other)
+
+    def translate(self, offset):
+        return Translate(self, offset)
+
+    def rotate(self, axis, angle):
+        return Rotate(self, axis, angle)
+
+    def scale(self, factor):
+        return Scale(self, factor)
+
+    def repeat(self, period, count=None):
+        return Repeat(self, period, count)
+
+    def apply(self, func, padding=0.):
+        return Apply(self, func, padding)
+
+
+class Sphere(Node):
+    def __init__(self, radius):
+        self.radius = float(radius)
+
+    def bounds(self):
+        return np.full(3, -self.radius), np.full(3, self.radius)
+
+    def build(self):
+        radius = self.radius
+
+        @ti.func
+        def sdf(p):
+            return p.norm() - radius
+
+        return sdf
+
+
+class Box(Node):
+    def __init__(self, size):
+        '''
+        size: half extents
+        '''
+        self.size = _vec(size)
+
+    def bounds(self):
+        return -np.array(self.size), np.array(self.size)
+
+    def build(self):
+        size = self.size
+
+        @ti.func
+        def sdf(p):
+            q = ti.abs(p) - ti.Vector(size)
+            return ti.max(q, 0.).norm() + ti.min(q.max(), 0.)
+
+        return sdf
+
+
+class Cylinder(Node):
+    '''
+    Capped cylinder along the y axis
+    '''
+    def __init__(self, radius, half_height):
+        self.radius = float(radius)
+        self.half_height = float(half_height)
+
+    def bounds(self):
+        size = np.array([self.radius, self.half_height, self.radius])
+        return -size, size
+
+    def build(self):
+        radius, half_height = self.radius, self.half_height
+
+        @ti.func
+        def sdf(p):
+            d = ti.Vector([ti.Vector([p[0], p[2]]).norm() - radius,
+                           ti.abs(p[1]) - half_height])
+            return ti.min(d.max(), 0.) + ti.max(d, 0.).norm()
+
+        return sdf
+
+
+class Plane(Node):
+    '''
+    Half space below the plane normal . p = offset
+    '''
+    def __init__(self, normal, offset=0.):
+        normal = np.array(normal, np.float64)
+        norm = np.linalg.norm(normal)
+        self.normal = _vec(normal / norm)
+        self.offset = float(offset / norm)
+
+    def build(self):
+        normal, offset = self.normal, self.offset
+
+        @ti.func
+        def sdf(p):
+            return p.dot(ti.Vector(normal)) - offset
+
+        return sdf
+
+
+def _smooth_min(k):
+    @ti.func
+    def smin(a, b):
+        d = ti.min(a, b)
+        if ti.static(k > 0):
+            h = ti.math.clamp(0.5 + 0.5 * (b - a) / k, 0., 1.)
+            d = ti.math.mix(b, a, h) - k * h * (1. - h)
+        return d
+
+    return smin
+
+
+def _smooth_max(k):
+    @ti.func
+    def smax(a, b):
+        d = ti.max(a, b)
+        if ti.static(k > 0):
+            h = ti.math.clamp(0.5 - 0.5 * (b - a) / k, 0., 1.)
+            d = ti.math.mix(b, a, h) + k * h * (1. - h)
+        return d
+
+    return smax
+
+
+class Union(Node):
+    def __init__(self, *children, k=0.):
+        '''
+        k > 0 blends the children over about k
+        '''
+        self.children = []
+        for child in children:
+            if isinstance(child, Union) and child.k == k:
+                self.children += child.children
+            else:
+                self.children.append(child)
+        self.k = float(k)
+
+    def bounds(self):
+        bounds = self.children[0].bounds()
+        for child in self.children[1:]:
+            bounds = _union_bounds(bounds, child.bounds())
+        #the blend is at most k / 4 below the closest child
+        return _pad_bounds(bounds, self.k / 4)
+
+    def build(self):
+        #unbounded children first: the others are skipped when farther
+        children = sorted(self.children, key=lambda c: c.bounds() is not None)
+        sdf = children[0].build()
+        for child in children[1:]:
+            sdf = _union(sdf, child.build(), child.bounds(), self.k)
+        return sdf
+
+
+def _union(sdf_a, sdf_b, bounds_b, k):
+    smin = _smooth_min(k)
+    culled = bounds_b is not None
+    box_min, box_max = (_vec(b) for b in bounds_b) if culled \
+        else ([0] * 3,) * 2
+
+    @ti.func
+    def sdf(p):
+        d = sdf_a(p)
+        if ti.static(culled):
+            #b >= its box distance, it can't change d if that is > d + k
+            dist = aabb_distance(ti.Vector(box_min), ti.Vector(box_max), p)
+            if dist <= 0 or dist < d + k:
+                d = smin(d, sdf_b(p))
+        else:
+            d = smin(d, sdf_b(p))
+        return d
+
+    return sdf
+
+
+class Subtraction(Node):
+    def __init__(self, a, b, k=0.):
+        '''
+        a minus b, k > 0 rounds the edges over about k
+        '''
+        self.a = a
+        self.b = b
+        self.k = float(k)
+
+    def bounds(self):
+        return self.a.bounds()
+
+    def build(self):
+        sdf_a = self.a.build()
+        sdf_b = self.b.build()
+        smax = _smooth_max(self.k)
+        k = self.k
+        bounds_b = self.b.bounds()
+        culled = bounds_b is not None
+        box_min, box_max = (_vec(b) for b in bounds_b) if culled \
+            else ([0] * 3,) * 2
+
+        @ti.func
+        def sdf(p):
+            d = sdf_a(p)
+            if ti.static(culled):
+                #-b <= -(box distance of b), it can't change d if that is
+                #< d - k
+                dist = aabb_distance(ti.Vector(box_min), ti.Vector(box_max), p)
+                if dist <= 0 or d + dist < k:
+                    d = smax(d, -sdf_b(p))
+            else:
+                d = smax(d, -sdf_b(p))
+            return d
+
+        return sdf
+
+
+class Intersection(Node):
+    def __init__(self, a, b, k=0.):
+        self.a = a
+        self.b = b
+        self.k = float(k)
+
+    def bounds(self):
+        return _intersection_bounds(self.a.bounds(), self.b.bounds())
+
+    def build(self):
+        sdf_a = self.a.build()
+        sdf_b = self.b.build()
+        smax = _smooth_max(self.k)
+
+        @ti.func
+        def sdf(p):
+            return smax(sdf_a(p), sdf_b(p))
+
+        return sdf
+
+
+def smooth_union(*children, k):
+    return Union(*children, k=k)
+
+
+def smooth_subtraction(a, b, k):
+    return Subtraction(a, b, k)
+
+
+def smooth_intersection(a, b, k):
+    return Intersection(a, b, k)
+
+
+class Translate(Node):
+    def __init__(self, child, offset):
+        self.child = child
+        self.offset = _vec(offset)
+
+    def bounds(self):
+        bounds = self.child.bounds()
+        if bounds is None:
+            return None
+        return bounds[0] + self.offset, bounds[1] + self.offset
+
+    def build(self):
+        child = self.child.build()
+        offset = self.offset
+
+        @ti.func
+        def sdf(p):
+            return child(p - ti.Vector(offset))
+
+        return sdf
+
+
+class Rotate(Node):
+    def __init__(self, child, axis, angle):
+        '''
+        Counterclockwise rotation by angle radians around axis
+        '''
+        self.child = child
+        self.axis = _vec(axis)
+        self.angle = float(angle)
+
+    def _matrix(self):
+        return np_rotate_matrix(np.array(self.axis), self.angle)[:3, :3]
+
+    def bounds(self):
+        bounds = self.child.bounds()
+        if bounds is None:
+            return None
+        corners = np.array([[bounds[i][0], bounds[j][1], bounds[k][2]]
+                            for i in (0, 1) for j in (0, 1) for k in (0, 1)])
+        corners = corners @ self._matrix().T
+        return corners.min(axis=0), corners.max(axis=0)
+
+    def build(self):
+        child = self.child.build()
+        inverse = self._matrix().T.tolist()
+
+        @ti.func
+        def sdf(p):
+            return child(ti.Matrix(inverse) @ p)
+
+        return sdf
+
+
+class Scale(Node):
+    def __init__(self, child, factor):
+        '''
+        Uniform scale (keeps the distances exact)
+        '''
+        self.child = child
+        self.factor = float(factor)
+
+    def bounds(self):
+        bounds = self.child.bounds()
+        if bounds is None:
+            return None
+        return bounds[0] * self.factor, bounds[1] * self.factor
+
+    def build(self):
+        child = self.child.build()
+        factor = self.factor
+
+        @ti.func
+        def sdf(p):
+            return child(p / factor) * factor
+
+        return sdf
+
+
+class Repeat(Node):
+    def __init__(self, child, period, count=None):
+        '''
+        Copies of child every period[i] along axis i (0: no repetition),
+        count[i] copies on each side of the original, infinitely many when
+        count is None. child should fit in its cell.
+        '''
+        self.child = child
+        self.period = _vec(period)
+        self.count = None if count is None else [int(c) for c in count]
+
+    def bounds(self):
+        bounds = self.child.bounds()
+        if bounds is None:
+            return None
+        if self.count is None:
+            return None if any(self.period) else bounds
+        extent = np.array(self.period) * self.count
+        return bounds[0] - extent, bounds[1] + extent
+
+    def build(self):
+        child = self.child.build()
+        period, count = self.period, self.count
+        limited = count is not None
+
+        @ti.func
+        def sdf(p):
+            q = p
+            for i in ti.static(range(3)):
+                if ti.static(period[i] > 0):
+                    c = ti.round(p[i] / period[i])
+                    if ti.static(limited):
+                        c = ti.math.clamp(c, -count[i], count[i])
+                    q[i] = p[i] - period[i] * c
+            return child(q)
+
+        return sdf
+
+
+class Apply(Node):
+    def __init__(self, child, func, padding=0.):
+        '''
+        func(distance) (a ti.func), which moves the surface by at most
+        padding outwards
+        '''
+        self.child = child
+        self.func = func
+        self.padding = float(padding)
+
+    def __repr__(self):
+        name = getattr(self.func, '__qualname__', repr(self.func))
+        return f"Apply(child={self.child!r}, func={name}, " \
+            f"padding={self.padding!r})"
+
+    def bounds(self):
+        return _pad_bounds(self.child.bounds(), self.padding)
+
+    def build(self):
+        child = self.child.build()
+        func = self.func
+
+        @ti.func
+        def sdf(p):
+            return func(child(p))
+
+        return sdf
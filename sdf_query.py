@@ -0,0 +1,130 @@
+'''
+Evaluates the scene sdf, its normals and colors on arrays of points outside
+of the renderer, e.g. for validation, datasets or collision queries:
+
+    points = np.random.uniform(-1, 1, (1000000, 3))
+    dist, normals = scene.evaluate_sdf(points, normals=True)
+
+The points are streamed to the kernel in chunks (they can be a np.memmap
+larger than the memory of the device), without allocating fields per call.
+'''
+import numpy as np
+import taichi as ti
+
+#placeholder for the outputs that are not asked for
+_NONE = np.zeros((1, 3), np.float32)
+
+
+@ti.data_oriented
+class SDFQuery:
+    def __init__(self, renderer, chunk_size=2**20):
+        self.renderer = renderer
+        self.chunk_size = chunk_size
+        #fields of the autodiff normals, allocated on first use
+        self._points = None
+        self._dist = None
+
+    @ti.kernel
+    def _evaluate(self, r: ti.template(),
+                  points: ti.types.ndarray(dtype=ti.math.vec3, ndim=1),
+                  dist: ti.types.ndarray(dtype=ti.f32, ndim=1),
+                  normals: ti.types.ndarray(dtype=ti.math.vec3, ndim=1),
+                  colors: ti.types.ndarray(dtype=ti.math.vec3, ndim=1),
+                  normal_mode: ti.template(), with_colors: ti.template()):
+        '''
+        normal_mode: 0 no normals, 1 finite differences (the renderer's
+        normal_strategy), 2 normals already computed (autodiff)
+        '''
+        for i in range(points.shape[0]):
+            p = points[i]
+            d = r.sdf(p)
+            dist[i] = d
+            if ti.static(normal_mode > 0):
+                n = ti.Vector([0.0, 0.0, 0.0])
+                if ti.static(normal_mode == 1):
+                    n = r.get_sdf_normal(p, 0.0, d)
+                    normals[i] = n
+                else:
+                    n = normals[i]
+                if ti.static(with_colors):
+                    colors[i] = r.get_sdf_color(p, n)
+
+    def _allocate_autodiff(self):
+        self._points = ti.Vector.field(3, dtype=ti.f32, shape=self.chunk_size,
+                                       needs_grad=True)
+        self._dist = ti.field(dtype=ti.f32, shape=self.chunk_size,
+                              needs_grad=True)
+
+    @ti.kernel
+    def _load_points(self, points: ti.types.ndarray(dtype=ti.math.vec3,
+                                                    ndim=1)):
+        for i in range(points.shape[0]):
+            self._points[i] = points[i]
+
+    @ti.kernel
+    def _autodiff_sdf(self, r: ti.template(), n: ti.i32):
+        for i in range(n):
+            self._dist[i] = r.sdf(self._points[i])
+
+    @ti.kernel
+    def _store_gradients(self, normals: ti.types.ndarray(dtype=ti.math.vec3,
+                                                         ndim=1)):
+        for i in range(normals.shape[0]):
+            normals[i] = self._points.grad[i].normalized(1e-12)
+
+    def _autodiff_normals(self, points, normals):
+        if self._points is None:
+            self._allocate_autodiff()
+        n = points.shape[0]
+        self._load_points(points)
+        self._points.grad.fill(0)
+        self._dist.grad.fill(1)
+        self._autodiff_sdf(self.renderer, n)
+        try:
+            self._autodiff_sdf.grad(self.renderer, n)
+        except RuntimeError as e:
+            raise ValueError("Taichi autodiff can't differentiate this sdf, "
+                             "use normals=True") from e
+        self._store_gradients(normals)
+
+    def evaluate(self, points, normals=False, colors=False):
+        '''
+        points: (N, 3) array. Returns the distances (N,), followed by the
+        normals and/or the colors (N, 3) when asked for.
+        normals: True for the renderer's normal_strategy (finite
+        differences) or 'autodiff' (Taichi autodiff, for sdfs without
+        break or data-dependent loops).
+        '''
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise ValueError(f"Expected (N, 3) points, got {points.shape}")
+        if normals not in (False, True, 'autodiff'):
+            raise ValueError(f"Unknown normals {normals!r}, expected a bool "
+                             "or 'autodiff'")
+        count = points.shape[0]
+        dist = np.empty(count, np.float32)
+        out_normals = np.empty((count, 3), np.float32) \
+            if normals or colors else None
+        out_colors = np.empty((count, 3), np.float32) if colors else None
+        normal_mode = 0
+        if normals == 'autodiff':
+            normal_mode = 2
+        elif normals or colors:
+            normal_mode = 1
+        for start in range(0, count, self.chunk_size):
+            end = min(start + self.chunk_size, count)
+            chunk = np.ascontiguousarray(points[start:end], np.float32)
+            chunk_normals = _NONE if out_normals is None \
+                else out_normals[start:end]
+            if normal_mode == 2:
+                self._autodiff_normals(chunk, chunk_normals)
+            self._evaluate(self.renderer, chunk, dist[start:end],
+                           chunk_normals,
+                           _NONE if out_colors is None
+                           else out_colors[start:end],
+                           normal_mode, bool(colors))
+        result = (dist,)
+        if normals:
+            result += (out_normals,)
+        if colors:
+            result += (out_colors,)
+        return result if len(result) > 1 else dist
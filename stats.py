@@ -0,0 +1,124 @@
+import numpy as np
+import taichi as ti
+
+#what the heatmap view can show, per sample of each pixel
+HEATMAPS = ('steps', 'evals', 'bounces', 'capped')
+#how a march ended, index of RenderStats.exits
+EXIT_HIT, EXIT_STEP_CAP, EXIT_LIMIT = 0, 1, 2
+
+
+@ti.data_oriented
+class RenderStats:
+    '''
+    Per pixel cost counters of the rendering, summed over the samples like
+    the color: sphere tracing steps, sdf evaluations (marches and normals),
+    how the marches ended (hit, ray_march_sdf_steps cap, or distance limit:
+    DIS_LIMIT, an analytic occluder or the end of the bounding volumes)
+    and bounces per path. The renderer only records them when compiled
+    with collect_stats.
+    '''
+    def __init__(self, image_res):
+        self.image_res = image_res
+        self.steps = ti.field(dtype=ti.i32, shape=image_res)
+        self.evals = ti.field(dtype=ti.i32, shape=image_res)
+        self.exits = ti.Vector.field(3, dtype=ti.i32, shape=image_res)
+        self.bounces = ti.field(dtype=ti.i32, shape=image_res)
+        self.paths = ti.field(dtype=ti.i32, shape=image_res)
+        self._max = ti.field(dtype=ti.f32, shape=())
+
+    def reset(self):
+        self.steps.fill(0)
+        self.evals.fill(0)
+        self.exits.fill(0)
+        self.bounces.fill(0)
+        self.paths.fill(0)
+
+    @ti.func
+    def record_ray(self, u, v, cost, bounce):
+        '''
+        Adds the cost (steps, sdf evaluations, exit) of a ray of the pixel
+        u, v (see Renderer.ray_march_sdf()), exit < 0 when it wasn't
+        marched. bounce: 1 for the rays extending the path, 0 for the shadow
+        rays.
+        '''
+        self.steps[u, v] += cost[0]
+        self.evals[u, v] += cost[1]
+        if cost[2] >= 0:
+            self.exits[u, v][cost[2]] += 1
+        self.bounces[u, v] += bounce
+
+    @ti.func
+    def record_path(self, u, v):
+        self.paths[u, v] += 1
+
+    @ti.func
+    def value(self, u, v, heatmap: ti.template()):
+        n = ti.max(self.paths[u, v], 1)
+        x = 0.0
+        if ti.static(heatmap == 'steps'):
+            x = self.steps[u, v] / n
+        elif ti.static(heatmap == 'evals'):
+            x = self.evals[u, v] / n
+        elif ti.static(heatmap == 'bounces'):
+            x = self.bounces[u, v] / n
+        else:
+            #fraction of the marches stopped by the step cap
+            x = self.exits[u, v][EXIT_STEP_CAP] / \
+                ti.max(self.exits[u, v].sum(), 1)
+        return x
+
+    @ti.kernel
+    def _max_value(self, r: ti.template(), heatmap: ti.template()):
+        k = r._scale[None]
+        self._max[None] = 0.
+        for u, v in ti.ndrange(-(-self.image_res[0] // k),
+                               -(-self.image_res[1] // k)):
+            ti.atomic_max(self._max[None], self.value(u, v, heatmap))
+
+    @ti.kernel
+    def _render_heatmap(self, r: ti.template(), heatmap: ti.template(),
+                        scale: ti.f32):
+        k = r._scale[None]
+        for i, j in r._rendered_image:
+            x = ti.min(self.value(i // k, j // k, heatmap) / scale, 1.)
+            #jet colormap: blue (cheap) to red (expensive)
+            r._rendered_image[i, j] = ti.math.clamp(
+                1.5 - ti.abs(4. * x - ti.Vector([3., 2., 1.])), 0., 1.)
+
+    def heatmap(self, r, heatmap, scale=None):
+        '''
+        Draws the heatmap into the image of renderer r, scale is the value
+        shown in red (default: the largest one)
+        '''
+        if scale is None:
+            self._max_value(r, heatmap)
+            scale = self._max[None]
+        self._render_heatmap(r, heatmap, max(scale, 1e-6))
+        return r._rendered_image
+
+    def summary(self):
+        '''
+        Scene statistics as a dict: averages per path, fractions of the
+        march exits and percentiles of the per pixel steps per path
+        '''
+        paths = self.paths.to_numpy()
+        sampled = paths > 0
+        n = max(int(paths.sum()), 1)
+        exits = self.exits.to_numpy()[sampled].sum(axis=0)
+        marches = max(int(exits.sum()), 1)
+        steps = self.steps.to_numpy()
+        pixel_steps = steps[sampled] / paths[sampled] if sampled.any() \
+            else np.zeros(1)
+        return {
+            'paths': int(paths.sum()),
+            'steps_per_path': float(steps.sum()) / n,
+            'evals_per_path': float(self.evals.to_numpy().sum()) / n,
+            'bounces_per_path': float(self.bounces.to_numpy().sum()) / n,
+            'steps_per_march': float(steps.sum()) / marches,
+            'hit_fraction': float(exits[EXIT_HIT]) / marches,
+            'step_cap_fraction': float(exits[EXIT_STEP_CAP]) / marches,
+            'distance_limit_fraction': float(exits[EXIT_LIMIT]) / marches,
+            'pixel_steps_p50': float(np.percentile(pixel_steps, 50)),
+            'pixel_steps_p99': float(np.percentile(pixel_steps, 99)),
+            'pixel_steps_max': float(pixel_steps.max()),
+        }
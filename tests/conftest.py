@@ -0,0 +1,32 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+
+RES = (32, 18)
+
+
+@pytest.fixture(scope='session')
+def scene():
+    '''
+    The default scene on the cpu, created once: ti.init() frees the fields
+    of the previous scenes
+    '''
+    return benchmark.load_benchmark_scene('default')
+
+
+@pytest.fixture
+def make_renderer(scene):
+    '''
+    make_renderer(**settings): a renderer of the scene at RES with these
+    Renderer attributes
+    '''
+    def make(**settings):
+        renderer = benchmark.prepare(scene, RES)
+        for k, v in settings.items():
+            setattr(renderer, k, v)
+        return renderer
+    return make
@@ -0,0 +1,58 @@
+import json
+import numpy as np
+import pytest
+
+from animation import CameraPath
+
+
+def keyframe(frame, position, fov=None):
+    k = {'frame': frame, 'position': position, 'look_at': (0, 0, 0)}
+    if fov is not None:
+        k['fov'] = fov
+    return k
+
+
+def test_passes_through_keyframes():
+    path = CameraPath([keyframe(10, (1, 2, 3), 0.3), keyframe(0, (0, 0, 1)),
+                       keyframe(20, (-1, 0, 2))])
+    assert path.num_frames == 21
+    for frame, position in ((0, (0, 0, 1)), (10, (1, 2, 3)),
+                            (20, (-1, 0, 2))):
+        np.testing.assert_allclose(path(frame)[0], position)
+    #missing fovs are the previous keyframe's, the first one the default
+    assert path(0)[2] == pytest.approx(0.23)
+    assert path(20)[2] == pytest.approx(0.3)
+    assert path(5)[2] == pytest.approx(0.5 * (0.23 + 0.3))
+
+
+def test_stays_on_a_straight_line():
+    path = CameraPath([keyframe(0, (0, 0, 0)), keyframe(4, (4, 0, 0))])
+    x = [path(f)[0] for f in np.linspace(0, 4, 17)]
+    np.testing.assert_allclose(np.array(x)[:, 1:], 0)
+    assert np.all(np.diff(np.array(x)[:, 0]) > 0)
+    #clamped outside of the keyframes
+    np.testing.assert_allclose(path(-3)[0], (0, 0, 0))
+    np.testing.assert_allclose(path(9)[0], (4, 0, 0))
+
+
+def test_single_keyframe():
+    path = CameraPath([keyframe(0, (1, 1, 1))])
+    np.testing.assert_allclose(path(7)[0], (1, 1, 1))
+
+
+def test_duplicate_keyframes():
+    with pytest.raises(ValueError, match='3, 10'):
+        CameraPath([keyframe(0, (0, 0, 0)), keyframe(10, (1, 0, 0)),
+                    keyframe(10, (2, 0, 0)), keyframe(3, (0, 1, 0)),
+                    keyframe(3, (0, 2, 0))])
+    with pytest.raises(ValueError):
+        CameraPath([])
+
+
+def test_load(tmp_path):
+    fname = tmp_path / 'path.json'
+    fname.write_text(json.dumps([keyframe(0, (0, 0, 0)),
+                                 keyframe(2, (2, 0, 0))]))
+    path = CameraPath.load(str(fname), default_fov=0.5)
+    np.testing.assert_allclose(path(1)[0], (1, 0, 0))
+    assert path(1)[2] == pytest.approx(0.5)
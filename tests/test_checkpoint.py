@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from checkpoint import Checkpoint, merge, view_hash
+
+
+def render(renderer, spp):
+    for _ in range(spp):
+        renderer.accumulate()
+    return renderer
+
+
+def test_round_trip(make_renderer, tmp_path):
+    path = str(tmp_path / 'render.npy')
+    r = render(make_renderer(sampler='hash'), 3)
+    Checkpoint(path).save(r)
+    resumed = make_renderer(sampler='hash')
+    assert Checkpoint(path).load(resumed)
+    assert resumed.current_spp == 3
+    np.testing.assert_array_equal(resumed.color_buffer.to_numpy(),
+                                  r.color_buffer.to_numpy())
+    #the resumed samples are the ones an uninterrupted render would take
+    render(resumed, 2)
+    render(r, 2)
+    np.testing.assert_allclose(resumed.color_buffer.to_numpy(),
+                               r.color_buffer.to_numpy(), atol=1e-5)
+    assert not Checkpoint(str(tmp_path / 'missing.npy')).load(r)
+
+
+def test_resume_appends_ranges(make_renderer, tmp_path):
+    path = str(tmp_path / 'render.npy')
+    Checkpoint(path).save(render(make_renderer(sampler='hash'), 2))
+    checkpoint = Checkpoint(path)
+    r = make_renderer(sampler='hash')
+    checkpoint.load(r)
+    checkpoint.save(render(r, 3))
+    meta = checkpoint.read_meta()
+    assert meta['spp'] == 5
+    assert meta['sample_ranges'] == [[0, 0, 5]]
+
+
+def test_other_view(make_renderer, tmp_path):
+    path = str(tmp_path / 'render.npy')
+    Checkpoint(path).save(render(make_renderer(), 1))
+    r = make_renderer()
+    r.set_camera_pos(0., 1., 5.)
+    with pytest.raises(ValueError, match='another scene'):
+        Checkpoint(path).load(r)
+
+
+def test_sampling_settings_keep_the_view(make_renderer):
+    r = make_renderer()
+    h = view_hash(r)
+    r.seed = 3
+    r.collect_stats = True
+    assert view_hash(r) == h
+
+
+def test_merge(make_renderer, tmp_path):
+    paths = [str(tmp_path / f'seed{seed}.npy') for seed in (0, 1)]
+    renderers = []
+    for seed, path in zip((0, 1), paths):
+        renderers.append(render(make_renderer(sampler='hash', seed=seed), 4))
+        Checkpoint(path).save(renderers[-1])
+    output = str(tmp_path / 'merged.npy')
+    merge(paths, output)
+    meta = Checkpoint(output).read_meta()
+    assert meta['spp'] == 8
+    assert meta['sample_ranges'] == [[0, 0, 4], [1, 0, 4]]
+    total = sum(r.color_buffer.to_numpy() for r in renderers)
+    np.testing.assert_allclose(np.load(output)[..., :3], total, rtol=1e-6)
+    np.testing.assert_array_equal(np.load(output)[..., 3], 8)
+
+    #resumed with seed 0: the samples follow the ones of seed 0
+    checkpoint = Checkpoint(output)
+    r = make_renderer(sampler='hash', seed=0)
+    checkpoint.load(r)
+    assert r.sample_offset + r.current_spp == 4
+    checkpoint.save(render(r, 2))
+    assert checkpoint.read_meta()['sample_ranges'] == \
+        [[0, 0, 4], [1, 0, 4], [0, 4, 6]]
+    continued = render(make_renderer(sampler='hash', seed=0), 6)
+    np.testing.assert_allclose(
+        r.color_buffer.to_numpy(),
+        continued.color_buffer.to_numpy() + renderers[1].color_buffer.to_numpy(),
+        atol=1e-5)
+
+    with pytest.raises(ValueError, match='share samples'):
+        merge([output, paths[1]], str(tmp_path / 'overlap.npy'))
+
+
+def test_adaptive_resume(make_renderer, tmp_path):
+    path = str(tmp_path / 'render.npy')
+    settings = dict(sampler='hash', adaptive_threshold=0.05, adaptive_tile=8,
+                    adaptive_min_spp=8)
+    r = render(make_renderer(**settings), 10)
+    Checkpoint(path).save(r)
+    resumed = make_renderer(**settings)
+    Checkpoint(path).load(resumed)
+    np.testing.assert_array_equal(resumed._lum_sq_buffer.to_numpy(),
+                                  r._lum_sq_buffer.to_numpy())
+    #all the tiles are active again, the converged ones retire at once
+    render(resumed, 1)
+    render(r, 1)
+    assert resumed.coverage == pytest.approx(r.coverage)
+
+    #without the second moments the variance is unknown
+    uniform = str(tmp_path / 'uniform.npy')
+    Checkpoint(uniform).save(render(make_renderer(sampler='hash'), 2))
+    with pytest.raises(ValueError, match='without adaptive sampling'):
+        Checkpoint(uniform).load(make_renderer(**settings))
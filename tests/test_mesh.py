@@ -0,0 +1,39 @@
+import numpy as np
+
+import mesh
+from sdf_graph import Sphere
+
+
+def unpaired_edges(faces):
+    edges = np.sort(np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]],
+                                    faces[:, [2, 0]]]), axis=1)
+    _, counts = np.unique(edges, axis=0, return_counts=True)
+    return int((counts != 2).sum())
+
+
+def test_closed_sphere(make_renderer):
+    center, radius = np.array([0.1, 0.2, 0.]), 0.7
+    r = make_renderer()
+    r.sdf = Sphere(radius).translate(center).compile()
+    #the surface touches the box (up to rounding)
+    vertices, faces = mesh.extract_mesh(r, center - radius + 1e-5,
+                                        center + radius - 1e-5, depth=5)
+    assert len(faces) > 0
+    assert np.isfinite(vertices).all()
+    assert unpaired_edges(faces) == 0
+    np.testing.assert_allclose(np.linalg.norm(vertices - center, axis=1),
+                               radius, atol=1e-3)
+    #outward normals: the signed volume is positive
+    a, b, c = (vertices[faces[:, i]] - center for i in range(3))
+    volume = np.einsum('ij,ij->i', a, np.cross(b, c)).sum() / 6
+    assert volume > 0.9 * 4 / 3 * np.pi * radius**3
+
+
+def test_write(tmp_path):
+    vertices = np.eye(3, dtype=np.float32)
+    faces = np.array([[0, 1, 2]], np.int32)
+    mesh.write_mesh(str(tmp_path / 'mesh.obj'), vertices, faces)
+    lines = (tmp_path / 'mesh.obj').read_text().splitlines()
+    assert lines[-1] == 'f 1 2 3'
+    mesh.write_mesh(str(tmp_path / 'mesh.ply'), vertices, faces)
+    assert (tmp_path / 'mesh.ply').read_bytes().startswith(b'ply\n')
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import sdf_graph
+
+
+def render(renderer, spp):
+    for _ in range(spp):
+        renderer.accumulate()
+    return renderer.color_buffer.to_numpy()
+
+
+def test_set_parameter_detects_changes(make_renderer):
+    r = make_renderer()
+    r.add_parameter('test_scale', 3.)
+    r.add_parameter('test_iterations', 14)
+    r.add_parameter('test_offset', (1., 1., 0.))
+    #not exactly representable in f32: changed once only
+    assert r.set_parameter('test_scale', 3.1)
+    assert r.framebuffer_dirty
+    r.framebuffer_dirty = False
+    assert not r.set_parameter('test_scale', 3.1)
+    assert not r.set_parameter('test_scale', np.float32(3.1))
+    assert not r.framebuffer_dirty
+    assert r.get_parameter('test_scale') == pytest.approx(3.1)
+    assert not r.set_parameter('test_iterations', 14)
+    assert r.set_parameter('test_iterations', 10)
+    assert r.get_parameter('test_iterations') == 10
+    assert not r.set_parameter('test_offset', [1., 1., 0.])
+    assert r.set_parameter('test_offset', (1., 1., 0.1))
+    assert not r.set_parameter('test_offset', r.get_parameter('test_offset'))
+    with pytest.raises(ValueError):
+        r.add_parameter('test_scale', 1.)
+
+
+@pytest.mark.parametrize('sampler', ['hash', 'sobol'])
+def test_sampler_reproducible(make_renderer, sampler):
+    a = render(make_renderer(sampler=sampler, seed=1), 4)
+    b = make_renderer(sampler=sampler, seed=1)
+    first = render(b, 2)
+    #another render starting at sample 2 takes the other half
+    c = make_renderer(sampler=sampler, seed=1, sample_offset=2)
+    np.testing.assert_allclose(first + render(c, 2), a, atol=1e-5)
+    np.testing.assert_array_equal(render(b, 2), a)
+    other_seed = render(make_renderer(sampler=sampler, seed=2), 4)
+    assert np.abs(other_seed - a).max() > 1e-3
+
+
+def test_plane_offset_is_normalized(scene, monkeypatch):
+    monkeypatch.setattr(scene.renderer, 'planes', [])
+    scene.add_plane((0, 2, 0), -0.2, (1, 1, 1))
+    normal, offset, _ = scene.renderer.planes[0]
+    np.testing.assert_allclose(normal, (0, 1, 0))
+    assert offset == pytest.approx(-0.1)
+    plane = sdf_graph.Plane((0, 2, 0), -0.2)
+    np.testing.assert_allclose(plane.normal, (0, 1, 0))
+    assert plane.offset == pytest.approx(-0.1)
+
+
+def test_denoiser_without_normals(make_renderer):
+    r = make_renderer(denoiser_settings={'iterations': 3})
+    render(r, 2)
+    #pixels without G-buffer samples, e.g. just reprojected
+    normal = r.denoiser.normal.to_numpy()
+    normal[4:12, 4:12] = 0
+    r.denoiser.normal.from_numpy(normal)
+    assert np.isfinite(r.fetch_image().to_numpy()).all()
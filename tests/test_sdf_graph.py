@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from sdf_graph import Box, Node, Sphere
+from sdf_query import SDFQuery
+
+
+def sphere_distance(points, center, radius):
+    return np.linalg.norm(points - np.array(center), axis=1) - radius
+
+
+def test_culled_union_is_exact(make_renderer):
+    #far apart children: most points cull all but one of them
+    centers = [(-3, 0, 0), (0, 0, 0), (3, 0, 0), (0, 3, 0)]
+    graph = Sphere(0.5).translate(centers[0])
+    for center in centers[1:]:
+        graph = graph | Sphere(0.5).translate(center)
+    r = make_renderer()
+    r.sdf = graph.compile()
+    points = np.random.default_rng(0).uniform(-5, 5, (4096, 3))
+    expected = np.min([sphere_distance(points, c, 0.5) for c in centers],
+                      axis=0)
+    np.testing.assert_allclose(SDFQuery(r).evaluate(points), expected,
+                               atol=1e-4)
+
+
+def test_bounds():
+    lo, hi = (Sphere(0.5).translate((1, 0, 0)) | Box((0.2, 0.3, 0.4))) \
+        .bounds()
+    np.testing.assert_allclose(lo, (-0.2, -0.5, -0.5))
+    np.testing.assert_allclose(hi, (1.5, 0.5, 0.5))
+    assert (Sphere(0.5) - Sphere(0.2)).bounds() is not None
+
+
+def test_node_is_abstract():
+    with pytest.raises(TypeError):
+        Node()
@@ -0,0 +1,184 @@
+import taichi as ti
+
+from math_utils import cosine_dir
+
+
+@ti.data_oriented
+class Wavefront:
+    '''
+    Wavefront version of Renderer.render(): one path per pixel like the
+    megakernel, but each stage (camera rays, extension rays, shading, shadow
+    rays) is its own kernel over a compacted queue of the paths still alive,
+    so paths ended by a miss or Russian roulette stop taking threads next
+    to long fractal marches.
+    Random numbers are drawn in the same order as in render(): with the
+    'hash' sampler both pipelines give the same image.
+    '''
+    def __init__(self, image_res, max_depth, dis_limit,
+                 directional_light=True):
+        n = image_res[0] * image_res[1]
+        self.max_depth = max_depth
+        self.dis_limit = dis_limit
+        self.directional_light = directional_light
+
+        #state of the paths
+        self.pixel = ti.Vector.field(2, dtype=ti.i32, shape=n)
+        self.pos = ti.Vector.field(3, dtype=ti.f32, shape=n)
+        self.dir = ti.Vector.field(3, dtype=ti.f32, shape=n)
+        self.t = ti.field(dtype=ti.f32, shape=n)  # known free of sdf
+        self.throughput = ti.Vector.field(3, dtype=ti.f32, shape=n)
+        self.contrib = ti.Vector.field(3, dtype=ti.f32, shape=n)
+        self.rng = ti.field(dtype=ti.u32, shape=n)
+        #hit of the last extension ray
+        self.closest = ti.field(dtype=ti.f32, shape=n)
+        self.normal = ti.Vector.field(3, dtype=ti.f32, shape=n)
+        self.color = ti.Vector.field(3, dtype=ti.f32, shape=n)
+        #shadow ray of the last bounce, weighted by the light visibility
+        self.light_dir = ti.Vector.field(3, dtype=ti.f32, shape=n)
+        self.light_weight = ti.Vector.field(3, dtype=ti.f32, shape=n)
+        #queues of path indices: extension rays of this bounce and of the
+        #next one (swapped each bounce), shadow rays; lengths in count
+        self.queue = ti.field(dtype=ti.i32, shape=(2, n))
+        self.shadow_queue = ti.field(dtype=ti.i32, shape=n)
+        self.count = ti.field(dtype=ti.i32, shape=3)
+        self.num_paths = ti.field(dtype=ti.i32, shape=())
+
+    @ti.kernel
+    def generate(self, r: ti.template()):
+        '''
+        Camera rays of the pixels of the window still sampled
+        '''
+        k = r._scale[None]
+        x0, y0, x1, y1 = r._window[None]
+        self.count[0] = 0
+        for u, v in ti.ndrange((x0, ti.min(x1, -(-r.image_res[0] // k))),
+                               (y0, ti.min(y1, -(-r.image_res[1] // k)))):
+            if ti.static(r.adaptive_threshold > 0):
+                if not r._tile_active[u // r.adaptive_tile,
+                                      v // r.adaptive_tile]:
+                    continue
+            i = ti.atomic_add(self.count[0], 1)
+            rng = r.start_sampling(u, v)
+            d, rng = r.get_cast_dir(u, v, rng)
+            if ti.static(r.collect_stats):
+                r.stats.record_path(u, v)
+            t = 0.0
+            if ti.static(r.prepass_tile > 0):
+                t = r.get_prepass_dist(u, v)
+            self.pixel[i] = ti.Vector([u, v])
+            self.pos[i] = r.camera_pos[None]
+            self.dir[i] = d
+            self.t[i] = t
+            self.throughput[i] = ti.Vector([1.0, 1.0, 1.0])
+            self.contrib[i] = ti.Vector([0.0, 0.0, 0.0])
+            self.rng[i] = rng
+            self.queue[0, i] = i
+        self.num_paths[None] = self.count[0]
+
+    @ti.kernel
+    def extend(self, r: ti.template(), src: ti.i32, bounce: ti.i32):
+        '''
+        Closest hits of the rays of queue src
+        '''
+        for q in range(self.count[src]):
+            i = self.queue[src, q]
+            u, v = self.pixel[i]
+            pos, d = self.pos[i], self.dir[i]
+            closest, normal, c, _, cost = r.next_hit(pos, d, self.t[i])
+            self.closest[i] = closest
+            self.normal[i] = normal
+            self.color[i] = c
+            if ti.static(r.collect_stats):
+                r.stats.record_ray(u, v, cost, 1)
+            if bounce == 0:
+                if ti.static(r.temporal_max_history > 0):
+                    r._hit_pos[u, v] = pos + ti.min(closest,
+                                                    self.dis_limit) * d
+                if ti.static(r.use_denoiser):
+                    if normal.norm() != 0 and closest < 1e8:
+                        r.denoiser.record(u, v, normal, c, closest)
+                    else:
+                        r.denoiser.record(u, v, -d, r.background_color[None],
+                                          self.dis_limit)
+
+    @ti.kernel
+    def shade(self, r: ti.template(), src: ti.i32, bounce: ti.i32):
+        '''
+        Bounces the paths of queue src: the survivors go to the other queue,
+        their shadow rays to shadow_queue
+        '''
+        dst = 1 - src
+        self.count[dst] = 0
+        self.count[2] = 0
+        for q in range(self.count[src]):
+            i = self.queue[src, q]
+            rng = self.rng[i]
+            throughput = self.throughput[i]
+            closest = self.closest[i]
+            normal = self.normal[i]
+            if normal.norm() != 0 and closest < 1e8:
+                r1, rng = r.next_random(rng)
+                r2, rng = r.next_random(rng)
+                d = cosine_dir(normal, r1, r2)
+                pos = self.pos[i] + closest * self.dir[i] + 1e-4 * d
+                throughput *= self.color[i]
+                if ti.static(self.directional_light):
+                    r1, rng = r.next_random(rng)
+                    r2, rng = r.next_random(rng)
+                    r3, rng = r.next_random(rng)
+                    light_dir = r.get_light_dir(r1, r2, r3)
+                    dot = light_dir.dot(normal)
+                    if dot > 0:
+                        self.light_dir[i] = light_dir
+                        self.light_weight[i] = throughput * \
+                            r.light_color[None] * dot
+                        self.shadow_queue[ti.atomic_add(self.count[2], 1)] = i
+                self.pos[i] = pos
+                self.dir[i] = d
+                self.t[i] = 0.0
+                # Russian roulette
+                max_c = throughput.max()
+                x, rng = r.next_random(rng)
+                if x > max_c:
+                    throughput = ti.Vector([0.0, 0.0, 0.0])
+                else:
+                    throughput /= max_c
+                    if bounce + 1 < self.max_depth:
+                        self.queue[dst, ti.atomic_add(self.count[dst], 1)] = i
+                    else:
+                        self.contrib[i] += throughput * r.ambient_color[None]
+            else:
+                #background
+                self.contrib[i] += throughput * (r.background_color[None] +
+                                                 r.ambient_color[None])
+            self.throughput[i] = throughput
+            self.rng[i] = rng
+
+    @ti.kernel
+    def trace_shadows(self, r: ti.template()):
+        for q in range(self.count[2]):
+            i = self.shadow_queue[q]
+            visibility, cost = r.light_visibility(self.pos[i],
+                                                  self.light_dir[i])
+            self.contrib[i] += self.light_weight[i] * visibility
+            if ti.static(r.collect_stats):
+                u, v = self.pixel[i]
+                r.stats.record_ray(u, v, cost, 0)
+
+    @ti.kernel
+    def finish(self, r: ti.template()):
+        for i in range(self.num_paths[None]):
+            u, v = self.pixel[i]
+            r.add_sample(u, v, self.contrib[i])
+
+    def render(self, r):
+        '''
+        One sample of the pixels of renderer r, like r.render()
+        '''
+        self.generate(r)
+        for bounce in range(self.max_depth):
+            src = bounce % 2
+            self.extend(r, src, bounce)
+            self.shade(r, src, bounce)
+            self.trace_shadows(r)
+        self.finish(r)